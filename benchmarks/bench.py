@@ -0,0 +1,165 @@
+"""Timing and memory benchmarks for loading, path construction and metrics.
+
+Synthetic exports of each size are generated once into ``--data-dir``; every
+step is then timed (best of ``--repeat`` runs) and its peak traced memory
+recorded. Results are compared with ``benchmarks/baseline.json`` and steps
+slower than ``--tolerance`` times their baseline are reported as
+regressions (non-zero exit status).
+
+    python benchmarks/bench.py --sizes 10000 100000 1000000
+    python benchmarks/bench.py --save-baseline
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clickstream import metrics  # noqa: E402
+from clickstream.bitmaps import SessionBitmaps  # noqa: E402
+from clickstream.cube import SessionCube  # noqa: E402
+from clickstream.engine import compute_kpis  # noqa: E402
+from clickstream.loader import LINK_COLS, read_csv, to_typed  # noqa: E402
+from clickstream.sessions import SessionStore  # noqa: E402
+from clickstream.synthetic import write_clickstream  # noqa: E402
+from clickstream.transitions import TransitionMatrix  # noqa: E402
+from clickstream.trie import PathTrie  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+LEGACY_PATH_LIMIT = 20_000  # the row-wise list column is too slow beyond this
+
+
+def measure(func, repeat):
+    """Best wall time over ``repeat`` runs and the peak traced memory of one run."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def steps(path, size):
+    """(name, callable) pairs; later steps reuse the results of earlier ones."""
+    state = {}
+
+    def load():
+        state['df'] = to_typed(read_csv(path))
+        return state['df']
+
+    def legacy_paths():
+        raw = read_csv(path)
+        return raw[LINK_COLS].apply(lambda row: row.dropna().tolist(), axis=1)
+
+    def encode():
+        state['store'] = SessionStore.from_frame(state['df'])
+        return state['store']
+
+    yield 'load_csv', load
+    if size <= LEGACY_PATH_LIMIT:
+        yield 'path_list_column', legacy_paths
+    yield 'path_encode', encode
+
+    def store():
+        return state['store']
+
+    # Cube-backed metrics are timed against a warm cube, as the dashboards see them
+    yield 'session_cube', lambda: SessionCube.from_store(store(), metrics.CONVERSION_PAGE)
+    yield 'bounce_rate_by_source', lambda: metrics.bounce_rate_by_source(store())
+    yield 'bounce_rate_by_source_device', lambda: metrics.bounce_rate_by_source_device(store(), ['search'])
+    yield 'avg_links_to_purchase', lambda: metrics.avg_links_to_purchase(store(), 'search')
+    yield 'calculate_purchase_success_rate', lambda: metrics.calculate_purchase_success_rate(store(), 'search')
+    yield 'avg_links_visited_by_source', lambda: metrics.avg_links_visited_by_source(store(), 'search')
+    yield 'conversion_rate_by_device', lambda: metrics.conversion_rate_by_device(store(), 'search')
+    yield 'conversion_rate_by_page', lambda: metrics.conversion_rate_by_page(store(), ['search'], ['pricing'])
+    yield 'conversion_rate_by_first_page', lambda: metrics.conversion_rate_by_first_page(store(), ['search'], ['home'])
+    yield 'dropoff_page_by_source_device', lambda: metrics.dropoff_page_by_source_device(store())
+    yield 'compute_kpis', lambda: compute_kpis(store())
+    yield 'transitions', lambda: TransitionMatrix.from_store(store())
+    yield 'path_trie', lambda: PathTrie.from_store(store())
+
+    def bitmaps():
+        state['bitmaps'] = SessionBitmaps.from_store(store())
+        return state['bitmaps']
+
+    def page_segment():
+        selected = state['bitmaps'].select(['pricing'], ['search'], ['mobile'])
+        return state['bitmaps'].conversions(selected), state['bitmaps'].breakdown(selected, 'exit')
+
+    yield 'session_bitmaps', bitmaps
+    yield 'page_segment_query', page_segment
+
+
+def run(sizes, data_dir, repeat):
+    os.makedirs(data_dir, exist_ok=True)
+    results = {}
+    for size in sizes:
+        path = os.path.join(data_dir, f'synthetic_{size}.csv')
+        if not os.path.exists(path):
+            write_clickstream(path, size)
+        for name, func in steps(path, size):
+            _, seconds, peak = measure(func, repeat)
+            results[f'{name}@{size}'] = {'seconds': seconds, 'peak_bytes': peak}
+            print(f'{name:>32} @ {size:>10,}: {seconds * 1000:10.2f} ms {peak / 2 ** 20:10.1f} MiB', flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Steps slower than ``tolerance`` times their baseline time."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base and result['seconds'] > base['seconds'] * tolerance:
+            regressions.append((key, base['seconds'], result['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--data-dir', default=os.path.join('data', 'bench'))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.data_dir, args.repeat)
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE):
+            with open(BASELINE, encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+        baseline.update(results)
+        report['results'] = baseline
+        with open(BASELINE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {BASELINE}')
+        return 0
+    if not os.path.exists(BASELINE):
+        print('No baseline yet; run with --save-baseline to record one.')
+        return 0
+    with open(BASELINE, encoding='utf-8') as f:
+        regressions = compare(results, json.load(f)['results'], args.tolerance)
+    for key, before, after in regressions:
+        print(f'REGRESSION {key}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Clickstream analytics shared by the Streamlit pages."""
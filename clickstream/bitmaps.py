@@ -0,0 +1,203 @@
+"""Bitmap index of sessions for page-level segment queries.
+
+Every page, exit page, Source, Device and the converted flag get one set
+of session ids. A question such as "sessions from search that visited
+blog_3, how many converted and where did they exit" is then a few
+intersections and popcounts, never a scan of the paths.
+
+Sets are stored like roaring bitmaps, choosing per value: a value held by
+fewer than one session in ``SPARSE_RATIO`` keeps a sorted array of its
+session ids, and a denser one a bitmap packed 64 sessions to a word (bit
+``i % 64`` of word ``i // 64``). Memory thus follows the number of
+sessions per value, however long the tail of rare pages. Selections are
+packed bitmaps, which a sparse set is intersected with by testing the
+bits of its ids.
+"""
+import numpy as np
+import pandas as pd
+
+from clickstream.loader import DATA_PATH, cached
+from clickstream.metrics import CONVERSION_PAGE
+from clickstream.profiling import profiled
+from clickstream.sessions import _as_list, load_sessions
+
+SPARSE_RATIO = 32  # a uint32 id beats a bitmap below one session in 32
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_ONE = np.uint64(1)
+
+
+def popcount(words):
+    """Set bits in the last axis of ``words``."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _BYTE_COUNTS[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def _bits(ids):
+    return np.left_shift(_ONE, (ids & 63).astype(np.uint64))
+
+
+def _words(ids, n_words):
+    """Packed bitmap of sorted session ids (duplicates allowed)."""
+    words = np.zeros(n_words, dtype=np.uint64)
+    if len(ids):
+        index = ids >> 6
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        words[index[starts]] = np.bitwise_or.reduceat(_bits(ids), starts)
+    return words
+
+
+def _ids(words, n_sessions):
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')[:n_sessions])
+
+
+def _container(ids, n_sessions):
+    """The sorted ids of one value as an id array or a packed bitmap, whichever is smaller."""
+    id_type = np.uint32 if n_sessions < 2 ** 32 else np.int64
+    if len(ids) * SPARSE_RATIO < n_sessions:
+        return np.unique(ids).astype(id_type)
+    words = _words(ids, -(-n_sessions // 64))
+    if popcount(words) * SPARSE_RATIO < n_sessions:  # repeat visits made it look denser
+        return _ids(words, n_sessions).astype(id_type)
+    return words
+
+
+def _containers(keys, ids, n_keys, n_sessions):
+    """One container per key from (key, session id) pairs, ids ascending; keys below 0 are left out."""
+    valid = keys >= 0
+    keys, ids = keys[valid], ids[valid].astype(np.int64)
+    order = np.argsort(keys.astype(np.int16) if n_keys < 2 ** 15 else keys, kind='stable')
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    ids = ids[order]
+    return [_container(ids[offsets[k]:offsets[k + 1]], n_sessions) for k in range(n_keys)]
+
+
+def _and(selected, container):
+    """Packed bitmap of the sessions in both a selection and a container."""
+    if container.dtype == np.uint64:
+        return selected & container
+    ids = container.astype(np.int64)
+    return _words(ids[(selected[ids >> 6] & _bits(ids)) != 0], len(selected))
+
+
+def _count(selected, container):
+    """Sessions in both a selection and a container."""
+    if container.dtype == np.uint64:
+        return int(popcount(selected & container))
+    ids = container.astype(np.int64)
+    return int(np.count_nonzero(selected[ids >> 6] & _bits(ids)))
+
+
+class SessionBitmaps:
+    """Session sets per page visited, exit page, Source, Device and conversion."""
+
+    def __init__(self, n_sessions, labels, sets, converted):
+        self.n_sessions = n_sessions
+        # Values of each dimension, in set order
+        self.labels = labels
+        # One container (id array or packed bitmap) per value of each dimension
+        self.sets = sets
+        self.converted = converted
+        self.all = np.full(-(-n_sessions // 64), np.uint64(2 ** 64 - 1))
+        if n_sessions % 64:
+            self.all[-1] = np.uint64(2 ** (n_sessions % 64) - 1)
+
+    @classmethod
+    @profiled
+    def from_store(cls, store, conversion_page=CONVERSION_PAGE):
+        """Sets of every session in ``store``; session ids are its row numbers."""
+        n = len(store)
+        sessions = np.arange(n, dtype=np.int64)
+        labels = {'page': list(store.pages), 'exit': list(store.pages),
+                  'source': list(store.sources), 'device': list(store.devices)}
+        sets = {
+            'page': _containers(store.codes.astype(np.int64), store.session_index, len(store.pages), n),
+            'exit': _containers(store.last_page().astype(np.int64), sessions, len(store.pages), n),
+            'source': _containers(store.source_codes.astype(np.int64), sessions, len(store.sources), n),
+            'device': _containers(store.device_codes.astype(np.int64), sessions, len(store.devices), n),
+        }
+        converted = _container(np.flatnonzero(store.contains(conversion_page)), n)
+        return cls(n, labels, sets, converted)
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for sets in self.sets.values() for c in sets) + self.converted.nbytes
+
+    def __len__(self):
+        return self.n_sessions
+
+    def bitmap(self, dimension, values, match_all=False):
+        """Packed bitmap of the sessions matching any of ``values``, or all of them with ``match_all``."""
+        lookup = {label: code for code, label in enumerate(self.labels[dimension])}
+        codes = [lookup[value] for value in values if value in lookup]
+        if not codes or (match_all and len(codes) < len(values)):
+            return np.zeros_like(self.all)
+        if match_all:
+            selected = self.all.copy()
+            for code in codes:
+                selected = _and(selected, self.sets[dimension][code])
+            return selected
+        selected = np.zeros_like(self.all)
+        for code in codes:
+            container = self.sets[dimension][code]
+            selected |= container if container.dtype == np.uint64 else _words(container.astype(np.int64), len(selected))
+        return selected
+
+    def select(self, pages=None, sources=None, devices=None, exits=None, converted=None):
+        """Sessions visiting every page in ``pages`` and matching the other filters.
+
+        Within sources, devices and exit pages any selected value matches;
+        None or an empty list leaves a dimension unfiltered.
+        """
+        selected = self.all.copy()
+        if _as_list(pages):
+            selected &= self.bitmap('page', _as_list(pages), match_all=True)
+        for dimension, values in [('source', sources), ('device', devices), ('exit', exits)]:
+            if _as_list(values):
+                selected &= self.bitmap(dimension, _as_list(values))
+        if converted is not None:
+            hits = _and(selected, self.converted)
+            selected = hits if converted else selected & ~hits
+        return selected
+
+    def count(self, selected):
+        """Sessions in a selection."""
+        return int(popcount(selected))
+
+    def conversions(self, selected):
+        """Converted sessions in a selection."""
+        return _count(selected, self.converted)
+
+    def breakdown(self, selected, dimension):
+        """Sessions of a selection per value of ``dimension``, e.g. per exit page."""
+        counts = [_count(selected, container) for container in self.sets[dimension]]
+        return pd.Series(counts, index=pd.Index(self.labels[dimension], name=dimension.capitalize()), name='Sessions')
+
+    def sessions(self, selected):
+        """Session ids in a selection."""
+        return _ids(selected, self.n_sessions)
+
+    @profiled
+    def page_table(self, pages, sources=None, devices=None):
+        """Sessions, conversions, conversion rate and top exit page of the visitors of each page."""
+        segment = self.select(sources=sources, devices=devices)
+        rows = []
+        for page in pages:
+            selected = segment & self.bitmap('page', [page])
+            sessions, exits = self.count(selected), self.breakdown(selected, 'exit')
+            conversions = self.conversions(selected)
+            rows.append({
+                'page': page,
+                'sessions': sessions,
+                'conversions': conversions,
+                'conversion_rate': conversions / sessions * 100 if sessions else 0.0,
+                'top_exit': exits.idxmax() if sessions else None,
+            })
+        table = pd.DataFrame(rows, columns=['page', 'sessions', 'conversions', 'conversion_rate', 'top_exit'])
+        return table.set_index('page')
+
+
+def load_bitmaps(path=DATA_PATH):
+    """Session bitmaps for the export at ``path``, built once per file version."""
+    return cached(path, "bitmaps", lambda: SessionBitmaps.from_store(load_sessions(path)))
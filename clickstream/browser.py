@@ -0,0 +1,123 @@
+"""Row index behind the paginated data browser.
+
+``RowIndex`` keeps a posting list (sorted row numbers) per Source, Device,
+path length and visited page. A filter is answered by merging the posting
+lists of the selected values and intersecting across dimensions, starting
+from the shortest, so its cost follows the lists it touches rather than
+the file. Selections are kept, so paging through one costs a slice.
+"""
+import threading
+
+import numpy as np
+
+from clickstream.loader import DATA_PATH, cached
+from clickstream.profiling import profiled
+from clickstream.sessions import _as_list, load_sessions
+
+MAX_SELECTIONS = 32  # filter results kept per index
+DIMENSIONS = ['source', 'device', 'length', 'page']
+
+
+def _postings(keys, rows, n_keys):
+    """Rows grouped by key as (sorted rows, offsets); keys below 0 are left out."""
+    valid = keys >= 0
+    keys, rows = keys[valid], rows[valid]
+    order = np.argsort(keys, kind='stable')
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return rows[order].astype(np.int64), offsets
+
+
+class RowIndex:
+    """Posting lists of session rows for every filterable value."""
+
+    def __init__(self, n_rows, labels, postings):
+        self.n_rows = n_rows
+        # Values of each dimension, in posting list order
+        self.labels = labels
+        # (rows, offsets) per dimension
+        self.postings = postings
+        self._selections = {}
+        self._lock = threading.Lock()  # the index is shared by every session of the process
+
+    @classmethod
+    @profiled
+    def from_store(cls, store):
+        """Index of every session in ``store``; row numbers follow the loaded frame."""
+        sessions = np.arange(len(store), dtype=np.int64)
+        lengths = store.lengths
+        # Sessions visiting a page twice are listed once
+        order = np.lexsort((store.session_index, store.codes))
+        codes, visits = store.codes[order], store.session_index[order]
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = (codes[1:] != codes[:-1]) | (visits[1:] != visits[:-1])
+        labels = {
+            'source': list(store.sources),
+            'device': list(store.devices),
+            'length': list(range(int(lengths.max()) + 1 if len(store) else 1)),
+            'page': list(store.pages),
+        }
+        postings = {
+            'source': _postings(store.source_codes.astype(np.int64), sessions, len(store.sources)),
+            'device': _postings(store.device_codes.astype(np.int64), sessions, len(store.devices)),
+            'length': _postings(lengths.astype(np.int64), sessions, len(labels['length'])),
+            'page': _postings(codes[first].astype(np.int64), visits[first], len(store.pages)),
+        }
+        return cls(len(store), labels, postings)
+
+    def rows(self, dimension, values):
+        """Sorted rows matching any of ``values`` in one dimension."""
+        labels = self.labels[dimension]
+        rows, offsets = self.postings[dimension]
+        lookup = {label: code for code, label in enumerate(labels)}
+        codes = sorted(lookup[value] for value in values if value in lookup)
+        parts = [rows[offsets[code]:offsets[code + 1]] for code in codes]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        merged = np.concatenate(parts)
+        # Source, Device and length lists are disjoint; page lists may overlap
+        return np.unique(merged) if dimension == 'page' else np.sort(merged)
+
+    def select(self, sources=None, devices=None, lengths=None, pages=None):
+        """Sorted rows matching every given filter, or None when nothing is filtered.
+
+        Within a dimension any selected value matches; a page matches
+        sessions that visit it.
+        """
+        filters = [(name, tuple(_as_list(values)))
+                   for name, values in zip(DIMENSIONS, [sources, devices, lengths, pages]) if _as_list(values)]
+        if not filters:
+            return None
+        key = tuple(filters)
+        with self._lock:
+            selected = self._selections.get(key)
+        if selected is None:
+            lists = sorted((self.rows(name, values) for name, values in filters), key=len)
+            selected = lists[0]
+            for rows in lists[1:]:
+                if not len(selected):
+                    break
+                selected = np.intersect1d(selected, rows, assume_unique=True)
+            with self._lock:
+                while len(self._selections) >= MAX_SELECTIONS:
+                    del self._selections[next(iter(self._selections))]
+                self._selections[key] = selected
+        return selected
+
+    def count(self, selected):
+        """Rows in a selection from ``select``."""
+        return self.n_rows if selected is None else len(selected)
+
+    def page(self, selected, page, page_size):
+        """Row numbers on the 1-based ``page`` of a selection."""
+        start = (page - 1) * page_size
+        if selected is None:
+            return np.arange(start, min(start + page_size, self.n_rows))
+        return selected[start:start + page_size]
+
+
+def load_row_index(path=DATA_PATH):
+    """Row index for the export at ``path``, built once per file version."""
+    return cached(path, "row_index", lambda: RowIndex.from_store(load_sessions(path)))
@@ -0,0 +1,76 @@
+"""Headless batch jobs: ``python -m clickstream report data/*.csv``.
+
+Only the standard library is imported up front; pandas and the analytics
+modules load once a command actually runs, and Streamlit and matplotlib
+are never imported. Exports are reported in parallel, one per process.
+"""
+import argparse
+import functools
+import sys
+
+
+def _report_one(item, output_dir, fmt):
+    """Reports one (path, name) pair; returns (paths written, None) or (None, error message)."""
+    from clickstream.report import report_file
+
+    path, name = item
+    try:
+        return report_file(path, output_dir, fmt, name), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def report(args):
+    from clickstream.parallel import imap_bounded
+    from clickstream.report import report_names
+
+    write = functools.partial(_report_one, output_dir=args.output_dir, fmt=args.format)
+    items = list(zip(args.paths, report_names(args.paths)))
+    failed = 0
+    # A failing export is reported and skipped; the rest of the batch still runs
+    for path, (written, error) in zip(args.paths, imap_bounded(write, items, args.workers)):
+        if error is None:
+            print(f"{path}: {', '.join(written)}")
+        else:
+            failed += 1
+            print(f"{path}: failed: {error}", file=sys.stderr)
+    if failed:
+        print(f"{failed} of {len(items)} report(s) failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def db_ingest(args):
+    from clickstream.database import open_database
+
+    database = open_database(args.database)
+    try:
+        new = database.ingest(args.paths, args.chunksize)
+    finally:
+        database.close()
+    print(f"{len(new)} new file(s) ingested into {args.database}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='clickstream', description="Clickstream analytics without the dashboards.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = commands.add_parser('report', help="write campaign, platform and source KPI reports")
+    report_parser.add_argument('paths', nargs='+', help="clickstream exports (headerless CSV)")
+    report_parser.add_argument('--output-dir', default='reports')
+    report_parser.add_argument('--format', choices=['json', 'csv', 'parquet'], default='json')
+    report_parser.add_argument('--workers', type=int, help="processes (default: CLICKSTREAM_WORKERS or CPU count)")
+    report_parser.set_defaults(run=report)
+
+    ingest_parser = commands.add_parser('db-ingest', help="append exports to the SQLite session database")
+    ingest_parser.add_argument('paths', nargs='+', help="clickstream exports (headerless CSV)")
+    ingest_parser.add_argument('--database', default='data/clickstream.sqlite')
+    ingest_parser.add_argument('--chunksize', type=int, default=250_000)
+    ingest_parser.set_defaults(run=db_ingest)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
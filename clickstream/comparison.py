@@ -0,0 +1,136 @@
+"""Bootstrap confidence intervals and pairwise tests for the source KPIs.
+
+Every KPI of a (Source, Device) group depends on each session only through
+its path length and whether it converted, so resampling the group's
+sessions with replacement is the same as drawing a multinomial over its
+(length, converted) cells of the ``SessionCube``. All resamples of all
+groups are therefore one batched ``Generator.multinomial`` call whose cost
+does not depend on the number of sessions. 'all' roll-ups sum the
+resampled groups, as ``engine.rollup`` sums the observed ones.
+
+Differences between two groups are compared on their (independent)
+replicates: percentile intervals, and a two-sided p-value from the share
+of replicates on either side of zero. P-values are not corrected for the
+number of pairs compared.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from clickstream.cube import MAX_LENGTH
+from clickstream.engine import ALL, rollup
+from clickstream.loader import DATA_PATH, cached
+from clickstream.metrics import session_cube
+from clickstream.profiling import profiled
+from clickstream.sessions import load_sessions
+
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+METRICS = ['conversion_rate', 'bounce_rate', 'avg_links', 'avg_links_to_purchase']
+
+
+def _metrics(cells):
+    """KPI values of (..., length, converted) cell counts, as (..., metric)."""
+    lengths = np.arange(cells.shape[-2])
+    sessions = cells.sum(axis=(-2, -1))
+    bounces = cells[..., 1, :].sum(axis=-1)
+    conversions = cells[..., 1].sum(axis=-1)
+    pages = (cells.sum(axis=-1) * lengths).sum(axis=-1)
+    conversion_pages = (cells[..., 1] * lengths).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.stack([
+            conversions / sessions * 100,
+            bounces / sessions * 100,
+            pages / sessions,
+            np.where(conversions > 0, conversion_pages / conversions, 0),
+        ], axis=-1)
+
+
+class Bootstrap:
+    """Observed KPIs and their bootstrap replicates for every (Source, Device, all) group."""
+
+    def __init__(self, groups, estimates, replicates):
+        self.groups = groups  # MultiIndex of (Source, Device)
+        self.estimates = estimates  # (groups, metrics)
+        self.replicates = replicates  # (resamples, groups, metrics)
+
+    @classmethod
+    @profiled
+    def from_store(cls, store, resamples=RESAMPLES, seed=0):
+        """Resamples the sessions of every (Source, Device) group ``resamples`` times."""
+        cube = session_cube(store)
+        valid = (cube.cells['source'] >= 0) & (cube.cells['device'] >= 0)
+        shape = (len(store.sources), len(store.devices), MAX_LENGTH + 1, 2)
+        flat = np.ravel_multi_index([cube.cells[name][valid].astype(np.int64)
+                                     for name in ['source', 'device', 'length', 'converted']], shape)
+        cells = np.bincount(flat, weights=cube.counts[valid], minlength=np.prod(shape)).astype(np.int64)
+        cells = cells.reshape(len(store.sources) * len(store.devices), -1)
+
+        sessions = cells.sum(axis=1)
+        observed = np.flatnonzero(sessions)
+        rng = np.random.default_rng(seed)
+        draws = np.zeros((resamples,) + cells.shape, dtype=np.int64)
+        draws[:, observed] = rng.multinomial(sessions[observed], cells[observed] / sessions[observed, None],
+                                             size=(resamples, len(observed)))
+
+        # Roll up (source, 'all'), ('all', device) and ('all', 'all') like the KPI table
+        table = rollup(store.sources, store.devices, cells.reshape(shape[:2] + (-1,)), list(range(cells.shape[1])))
+        keep = (table.sum(axis=1) > 0).to_numpy()
+        draws = draws.reshape((resamples,) + shape[:2] + (-1,))
+        draws = np.concatenate([draws, draws.sum(axis=2, keepdims=True)], axis=2)
+        draws = np.concatenate([draws, draws.sum(axis=1, keepdims=True)], axis=1)
+        draws = draws.reshape(resamples, len(table), shape[2], shape[3])[:, keep]
+        estimates = _metrics(table.to_numpy()[keep].reshape(-1, shape[2], shape[3]))
+        return cls(table.index[keep], estimates, _metrics(draws))
+
+    def __len__(self):
+        return len(self.groups)
+
+    @property
+    def resamples(self):
+        return self.replicates.shape[0]
+
+    def _group(self, source, device):
+        return self.groups.get_loc((source, device))
+
+    def intervals(self, metric, confidence=CONFIDENCE):
+        """Estimate and percentile interval of ``metric`` for every group."""
+        m = METRICS.index(metric)
+        tail = (1 - confidence) / 2 * 100
+        low, high = np.nanpercentile(self.replicates[:, :, m], [tail, 100 - tail], axis=0)
+        return pd.DataFrame({'estimate': self.estimates[:, m], 'low': low, 'high': high}, index=self.groups)
+
+    def compare(self, metric, groups=None, confidence=CONFIDENCE):
+        """Every pair of ``groups`` (default: the sources over all devices) compared on ``metric``.
+
+        One row per pair with the difference (first minus second), its
+        percentile interval, a two-sided bootstrap p-value and whether it is
+        below ``1 - confidence``.
+        """
+        if groups is None:
+            groups = [(source, ALL) for source, device in self.groups if source != ALL and device == ALL]
+        m = METRICS.index(metric)
+        pairs = list(itertools.combinations(groups, 2))
+        first = [self._group(*a) for a, _ in pairs]
+        second = [self._group(*b) for _, b in pairs]
+        differences = self.replicates[:, first, m] - self.replicates[:, second, m]
+        tail = (1 - confidence) / 2 * 100
+        low, high = np.percentile(differences, [tail, 100 - tail], axis=0) if pairs else ([], [])
+        below = (differences <= 0).mean(axis=0)
+        above = (differences >= 0).mean(axis=0)
+        p_values = np.minimum(1, 2 * np.minimum(below, above))
+        return pd.DataFrame({
+            'a': pd.Series([a for a, _ in pairs], dtype=object),
+            'b': pd.Series([b for _, b in pairs], dtype=object),
+            'difference': self.estimates[first, m] - self.estimates[second, m],
+            'low': low,
+            'high': high,
+            'p_value': p_values,
+            'significant': p_values < 1 - confidence,
+        })
+
+
+def load_bootstrap(path=DATA_PATH, resamples=RESAMPLES):
+    """Bootstrap replicates for the export at ``path``, drawn once per file version."""
+    return cached(path, ("bootstrap", resamples), lambda: Bootstrap.from_store(load_sessions(path), resamples))
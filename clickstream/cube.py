@@ -0,0 +1,103 @@
+"""Pre-aggregated session count cube.
+
+Every session is reduced to six attributes: Source, Device, first page,
+last page, path length and whether it converted. The cube stores one count
+per distinct combination that occurs (a sparse list of cells), which is a
+few thousand rows however many sessions there are. Filtered metrics become
+a boolean mask and a weighted sum over those cells.
+"""
+import numpy as np
+
+from clickstream.profiling import profiled
+
+MAX_LENGTH = 16  # Longer paths share the last length bucket
+DIMENSIONS = ['source', 'device', 'first_page', 'last_page', 'length', 'converted']
+# Codes are stored shifted by these offsets so that -1 ("missing") becomes index 0
+OFFSETS = {'source': 1, 'device': 1, 'first_page': 1, 'last_page': 1, 'length': 0, 'converted': 0}
+
+
+class SessionCube:
+    """Sparse cells over (source, device, first page, last page, length, converted).
+
+    Codes follow the ``SessionStore`` they were built from; -1 marks a
+    missing Source/Device or the first/last page of an empty session.
+    """
+
+    def __init__(self, sources, devices, pages, cells, counts):
+        self.sources = sources
+        self.devices = devices
+        self.pages = pages
+        self.cells = cells
+        self.counts = counts
+
+    @classmethod
+    @profiled
+    def from_store(cls, store, conversion_page):
+        """Counts every session of ``store`` into its cube cell."""
+        values = [
+            store.source_codes.astype(np.int64),
+            store.device_codes.astype(np.int64),
+            store.first_page().astype(np.int64),
+            store.last_page().astype(np.int64),
+            np.minimum(store.lengths, MAX_LENGTH),
+            store.contains(conversion_page).astype(np.int64),
+        ]
+        cube = cls(store.sources, store.devices, store.pages, {}, None)
+        flat = np.ravel_multi_index([v + OFFSETS[name] for name, v in zip(DIMENSIONS, values)], cube.shape)
+        keys, cube.counts = np.unique(flat, return_counts=True)
+        for name, column, size in zip(DIMENSIONS, np.unravel_index(keys, cube.shape), cube.shape):
+            # Page codes of large vocabularies do not fit in int16
+            cube.cells[name] = (column - OFFSETS[name]).astype(np.int16 if size <= 2 ** 15 else np.int32)
+        return cube
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def shape(self):
+        """Dense size of every dimension, including the shifted "missing" slot."""
+        n_pages = len(self.pages)
+        return (len(self.sources) + 1, len(self.devices) + 1, n_pages + 1, n_pages + 1, MAX_LENGTH + 1, 2)
+
+    def _codes(self, labels, selected):
+        return np.flatnonzero(np.isin(labels, selected))
+
+    def mask(self, sources=None, devices=None, first_pages=None, last_pages=None, lengths=None, converted=None):
+        """Cells matching every given filter; None leaves a dimension unfiltered."""
+        mask = np.ones(len(self), dtype=bool)
+        if sources:
+            mask &= np.isin(self.cells['source'], self._codes(self.sources, sources))
+        if devices:
+            mask &= np.isin(self.cells['device'], self._codes(self.devices, devices))
+        if first_pages:
+            mask &= np.isin(self.cells['first_page'], self._codes(self.pages, first_pages))
+        if last_pages:
+            mask &= np.isin(self.cells['last_page'], self._codes(self.pages, last_pages))
+        if lengths is not None:
+            mask &= np.isin(self.cells['length'], lengths)
+        if converted is not None:
+            mask &= self.cells['converted'] == int(converted)
+        return mask
+
+    def count(self, mask=None):
+        """Sessions in the masked cells."""
+        return int(self.counts.sum() if mask is None else self.counts[mask].sum())
+
+    def totals(self, mask, by):
+        """Session counts of the masked cells grouped by one or more dimensions.
+
+        Returns a dict keyed by the code (or tuple of codes) of each
+        non-empty group.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        if not mask.any():
+            return {}
+        offsets = [OFFSETS[name] for name in by]
+        shape = [self.shape[DIMENSIONS.index(name)] for name in by]
+        flat = np.ravel_multi_index([self.cells[name][mask] + offset for name, offset in zip(by, offsets)], shape)
+        keys, inverse = np.unique(flat, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=self.counts[mask], minlength=len(keys)).astype(np.int64)
+        columns = [(column - offset).tolist() for column, offset in zip(np.unravel_index(keys, shape), offsets)]
+        if len(by) == 1:
+            return dict(zip(columns[0], sums.tolist()))
+        return dict(zip(zip(*columns), sums.tolist()))
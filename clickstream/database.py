@@ -0,0 +1,254 @@
+"""Sessions persisted in an embedded SQLite file.
+
+For history that does not fit in memory, exports are ingested chunk by
+chunk into a local database: one row per session (Source, Device, first
+and last page, length) and one per path step (session, position, page),
+with labels kept in small dimension tables. Source, Device, first/last
+page and (page, position) are indexed.
+
+``SessionDatabase`` answers the ``clickstream.metrics`` functions with the
+filters and grouping pushed down into SQL; pass it wherever those take a
+store. Only the standard library ``sqlite3`` is needed.
+
+    python -m clickstream db-ingest data/archive/*.csv --database data/clickstream.sqlite
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from clickstream.loader import file_key, read_csv
+from clickstream.profiling import profiled
+from clickstream.sessions import SessionStore, _as_list
+
+DATABASE_PATH = "data/clickstream.sqlite"
+CHUNK_SIZE = 250_000
+DIMENSIONS = ['sources', 'devices', 'pages']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS devices (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS pages (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    source INTEGER,
+    device INTEGER,
+    first_page INTEGER,
+    last_page INTEGER,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    session INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    PRIMARY KEY (session, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sessions INTEGER NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_source_device ON sessions (source, device);
+CREATE INDEX IF NOT EXISTS sessions_device ON sessions (device);
+CREATE INDEX IF NOT EXISTS sessions_first_page ON sessions (first_page);
+CREATE INDEX IF NOT EXISTS sessions_last_page ON sessions (last_page);
+CREATE INDEX IF NOT EXISTS steps_page_position ON steps (page, position);
+"""
+
+
+def _rate(hits, total):
+    return (hits / total) * 100
+
+
+class SessionDatabase:
+    """Session and path-step tables of a SQLite file, queried like a ``SessionStore``."""
+
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def labels(self, dimension):
+        """Label of every code of a dimension table."""
+        return dict(self.query(f"SELECT code, name FROM {dimension}"))
+
+    def _codes(self, dimension, labels):
+        """Codes of the given labels, creating the missing ones."""
+        self.connection.executemany(f"INSERT OR IGNORE INTO {dimension} (name) VALUES (?)", [(l,) for l in labels])
+        lookup = {name: code for code, name in self.connection.execute(f"SELECT code, name FROM {dimension}")}
+        return np.array([lookup[label] for label in labels] + [-1], dtype=np.int64)  # code -1 stays -1
+
+    # Ingestion
+
+    def _insert(self, store):
+        sources = self._codes('sources', list(store.sources))[store.source_codes]
+        devices = self._codes('devices', list(store.devices))[store.device_codes]
+        pages = self._codes('pages', list(store.pages))
+        first = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM sessions").fetchone()[0]
+        ids = first + np.arange(len(store), dtype=np.int64)
+
+        def nullable(codes):
+            return [None if code < 0 else code for code in codes.tolist()]
+
+        self.connection.executemany(
+            "INSERT INTO sessions (id, source, device, first_page, last_page, length) VALUES (?, ?, ?, ?, ?, ?)",
+            zip(ids.tolist(), nullable(sources), nullable(devices),
+                nullable(pages[store.first_page()]), nullable(pages[store.last_page()]), store.lengths.tolist()))
+        self.connection.executemany(
+            "INSERT INTO steps (session, position, page) VALUES (?, ?, ?)",
+            zip(ids[store.session_index].tolist(), store.positions.tolist(), pages[store.codes].tolist()))
+
+    def pending(self, paths):
+        """Files not yet ingested; raises ValueError for ingested files that changed."""
+        ingested = {path: (mtime_ns, size) for path, mtime_ns, size in self.query("SELECT path, mtime_ns, size FROM files")}
+        new, changed = [], []
+        for path in paths:
+            key, mtime_ns, size = file_key(path)
+            if key not in ingested:
+                new.append(path)
+            elif ingested[key] != (mtime_ns, size):
+                changed.append(path)
+        if changed:
+            raise ValueError(f"Already ingested files changed on disk, rebuild the database: {changed}")
+        return new
+
+    @profiled
+    def ingest(self, paths, chunksize=CHUNK_SIZE):
+        """Appends every new file in ``paths``, one transaction per file."""
+        new = self.pending(paths)
+        for path in new:
+            key, mtime_ns, size = file_key(path)
+            with self._lock, self.connection:
+                sessions = 0
+                with read_csv(path, chunksize=chunksize) as reader:
+                    for chunk in reader:
+                        store = SessionStore.from_frame(chunk)
+                        self._insert(store)
+                        sessions += len(store)
+                self.connection.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                                        (key, mtime_ns, size, sessions, time.time()))
+        return new
+
+    # Filters
+
+    def _lookup(self, dimension, labels):
+        lookup = {name: code for code, name in self.labels(dimension).items()}
+        return [lookup[label] for label in _as_list(labels) if label in lookup]
+
+    def _where(self, sources=None, devices=None, first_pages=None, last_pages=None, valid=False, extra=()):
+        """WHERE clause and parameters; None or an empty list leaves a column unfiltered."""
+        clauses, params = list(extra), []
+        if valid:
+            clauses.append("source IS NOT NULL AND device IS NOT NULL")
+        for column, dimension, labels in [('source', 'sources', sources), ('device', 'devices', devices),
+                                          ('first_page', 'pages', first_pages), ('last_page', 'pages', last_pages)]:
+            if _as_list(labels):
+                codes = self._lookup(dimension, labels)
+                clauses.append(f"{column} IN ({', '.join('?' * len(codes))})" if codes else "0")
+                params.extend(codes)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _converted(self, conversion_page):
+        """SQL expression and parameters for "the session visits ``conversion_page``"."""
+        codes = self._lookup('pages', [conversion_page])
+        return "id IN (SELECT session FROM steps WHERE page = ?)", [codes[0] if codes else -1]
+
+    # Metrics, as in clickstream.metrics
+
+    def bounce_rate_by_source(self):
+        names = self.labels('sources')
+        rows = self.query("SELECT source, COUNT(*), SUM(length < 2) FROM sessions"
+                          " WHERE source IS NOT NULL GROUP BY source")
+        return {names[s]: _rate(bounces, total) for s, total, bounces in sorted(rows, key=lambda r: names[r[0]])}
+
+    def bounce_rate_by_source_device(self, selected_sources=None, selected_devices=None):
+        sources, devices = self.labels('sources'), self.labels('devices')
+        where, params = self._where(selected_sources, selected_devices, valid=True)
+        rows = self.query(f"SELECT source, device, COUNT(*), SUM(length = 1) FROM sessions{where}"
+                          " GROUP BY source, device", params)
+        rows = sorted(rows, key=lambda r: (sources[r[0]], devices[r[1]]))
+        bounce_rates, by_source = {}, {}
+        for source, device, total, bounces in rows:
+            bounce_rates[(sources[source], devices[device])] = _rate(bounces, total)
+            totals = by_source.setdefault(sources[source], [0, 0])
+            totals[0] += total
+            totals[1] += bounces
+        for source, (total, bounces) in by_source.items():
+            bounce_rates[(source, 'all')] = _rate(bounces, total)
+        return bounce_rates
+
+    def avg_links_to_purchase(self, selected_source=None, conversion_page=None):
+        converted, params = self._converted(conversion_page)
+        where, more = self._where(selected_source, extra=[converted])
+        average = self.query(f"SELECT AVG(length) FROM sessions{where}", params + more)[0][0]
+        return average if average is not None else 0
+
+    def calculate_purchase_success_rate(self, selected_source=None, conversion_page=None):
+        converted, params = self._converted(conversion_page)
+        where, more = self._where(selected_source)
+        total, hits = self.query(f"SELECT COUNT(*), SUM({converted}) FROM sessions{where}", params + more)[0]
+        return _rate(hits, total) if total else 0
+
+    def avg_links_visited_by_source(self, selected_sources=None):
+        where, params = self._where(selected_sources)
+        average = self.query(f"SELECT AVG(length) FROM sessions{where}", params)[0][0]
+        return average if average is not None else 0
+
+    def conversion_rate_by_device(self, selected_sources=None, conversion_page=None):
+        names = self.labels('devices')
+        converted, params = self._converted(conversion_page)
+        where, more = self._where(selected_sources, extra=["device IS NOT NULL"])
+        rows = self.query(f"SELECT device, COUNT(*), SUM({converted}) FROM sessions{where} GROUP BY device",
+                          params + more)
+        return {names[d]: _rate(hits, total) for d, total, hits in sorted(rows, key=lambda r: names[r[0]])}
+
+    def _conversion_rate(self, conversion_page, **filters):
+        converted, params = self._converted(conversion_page)
+        where, more = self._where(**filters)
+        total, hits = self.query(f"SELECT COUNT(*), SUM({converted}) FROM sessions{where}", params + more)[0]
+        return _rate(hits, total) if total else 0
+
+    def conversion_rate_by_page(self, selected_sources=None, pages=None, conversion_page=None):
+        return self._conversion_rate(conversion_page, sources=selected_sources, last_pages=pages)
+
+    def conversion_rate_by_first_page(self, selected_sources=None, pages=None, conversion_page=None):
+        return self._conversion_rate(conversion_page, sources=selected_sources, first_pages=pages)
+
+    def dropoff_page_by_source_device(self, selected_sources=None, selected_devices=None, conversion_page=None):
+        sources, devices, pages = self.labels('sources'), self.labels('devices'), self.labels('pages')
+        where, params = self._where(selected_sources, selected_devices, valid=True)
+        groups = sorted((sources[s], devices[d]) for s, d in
+                        self.query(f"SELECT DISTINCT source, device FROM sessions{where}", params))
+        dropoff_pages = {group: None for group in groups}
+        conversion = self._lookup('pages', [conversion_page])
+        where, params = self._where(selected_sources, selected_devices, valid=True,
+                                    extra=["last_page IS NOT NULL", "last_page IS NOT ?"])
+        rows = self.query(f"SELECT source, device, last_page, COUNT(*) FROM sessions{where}"
+                          " GROUP BY source, device, last_page", (conversion or [None]) + params)
+        best = {}
+        # Ties keep the alphabetically first page, like Series.mode
+        for source, device, page, n in sorted(rows, key=lambda r: pages[r[2]]):
+            group = (sources[source], devices[device])
+            if n > best.get(group, 0):
+                best[group] = n
+                dropoff_pages[group] = pages[page]
+        return dropoff_pages
+
+
+def open_database(path=DATABASE_PATH):
+    """The session database at ``path``, created empty if it does not exist."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return SessionDatabase(path)
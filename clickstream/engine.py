@@ -0,0 +1,82 @@
+"""Single-pass KPI engine for the campaign and tab dashboards.
+
+``compute_kpis`` folds every session into per (Source, Device) counters with
+one ``np.bincount`` per counter, then rolls those up to (source, 'all'),
+('all', device) and ('all', 'all') rows. The dashboards slice the resulting
+table instead of re-filtering the sessions once per source and metric.
+"""
+import numpy as np
+import pandas as pd
+
+from clickstream.loader import DATA_PATH, cached
+from clickstream.metrics import CONVERSION_PAGE
+from clickstream.profiling import profiled
+from clickstream.sessions import load_sessions
+
+ALL = 'all'
+COUNT_COLUMNS = ['sessions', 'bounces', 'conversions', 'pages', 'conversion_pages']
+
+
+def _counts(store):
+    """Counter cube of shape (sources, devices, counters) in one grouped pass."""
+    n_sources, n_devices = len(store.sources), len(store.devices)
+    valid = (store.source_codes >= 0) & (store.device_codes >= 0)
+    group = store.source_codes[valid].astype(np.int64) * n_devices + store.device_codes[valid]
+    lengths = store.lengths[valid]
+    converted = store.contains(CONVERSION_PAGE)[valid]
+    size = n_sources * n_devices
+    counters = [
+        np.ones(len(group)),
+        lengths == 1,
+        converted,
+        lengths,
+        np.where(converted, lengths, 0),
+    ]
+    cube = np.stack([np.bincount(group, weights=w, minlength=size) for w in counters], axis=-1)
+    return cube.reshape(n_sources, n_devices, len(counters))
+
+
+def rollup(sources, devices, cube, columns):
+    """Frame of a (sources, devices, columns) count cube with 'all' roll-ups.
+
+    Rows are indexed by (Source, Device), including ('all', device),
+    (source, 'all') and ('all', 'all').
+    """
+    cube = np.concatenate([cube, cube.sum(axis=1, keepdims=True)], axis=1)
+    cube = np.concatenate([cube, cube.sum(axis=0, keepdims=True)], axis=0)
+    index = pd.MultiIndex.from_product([list(sources) + [ALL], list(devices) + [ALL]], names=['Source', 'Device'])
+    return pd.DataFrame(cube.reshape(-1, len(columns)), index=index, columns=columns).astype(np.int64)
+
+
+def kpi_table(sources, devices, cube):
+    """Tidy KPI table from a (sources, devices, counters) count cube.
+
+    Rows are indexed by (Source, Device), including 'all' roll-ups on both
+    levels; combinations without sessions are left out.
+    """
+    kpis = rollup(sources, devices, cube, COUNT_COLUMNS)
+    kpis = kpis[kpis['sessions'] > 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kpis['bounce_rate'] = kpis['bounces'] / kpis['sessions'] * 100
+        kpis['conversion_rate'] = kpis['conversions'] / kpis['sessions'] * 100
+        kpis['avg_links'] = kpis['pages'] / kpis['sessions']
+        kpis['avg_links_to_purchase'] = (kpis['conversion_pages'] / kpis['conversions']).fillna(0)
+    return kpis
+
+
+@profiled
+def compute_kpis(store):
+    """Bounce, conversion and path-length KPIs for every (Source, Device, all) combination."""
+    return kpi_table(store.sources, store.devices, _counts(store))
+
+
+def kpi_row(kpis, source=ALL, device=ALL):
+    """One row of the KPI table, all zeros when the combination has no sessions."""
+    if (source, device) in kpis.index:
+        return kpis.loc[(source, device)]
+    return pd.Series(0, index=kpis.columns)
+
+
+def load_kpis(path=DATA_PATH):
+    """KPI table for the export at ``path``, computed once per file version."""
+    return cached(path, "kpis", lambda: compute_kpis(load_sessions(path)))
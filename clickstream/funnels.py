@@ -0,0 +1,121 @@
+"""Ordered funnels over the encoded session paths.
+
+A funnel is a list of pages, e.g. home -> product -> purchase_start ->
+purchase_success. A session reaches step ``i`` when steps 1..i occur in
+that order in its path: anywhere after each other by default, or as one
+contiguous run of pages when ``strict``. Every step is one vectorized pass
+over the store's flat page codes, restricted to the sessions that reached
+the previous step (and, unless strict, to the pages after their match), so
+no per-session matrix is built. The result of every funnel prefix is kept,
+so dozens of funnels sharing their first steps cost little more than one.
+"""
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from clickstream.engine import rollup
+from clickstream.profiling import profiled
+
+MAX_PREFIXES = 256  # funnel prefixes kept per engine
+
+_engines = weakref.WeakKeyDictionary()
+
+
+class FunnelEngine:
+    """Sessions reaching each step of ordered funnels over one ``SessionStore``."""
+
+    def __init__(self, store):
+        self.store = store
+        self._prefixes = {}
+        self._lock = threading.Lock()  # engines are shared by every session of the process
+
+    def _first(self, code, strict):
+        store = self.store
+        hits = np.flatnonzero(store.codes == code)
+        sessions = store.session_index[hits].astype(np.int64)
+        if strict:
+            # Every (session, position) where a contiguous match of the steps so far starts
+            return np.unique(sessions), (sessions, store.positions[hits])
+        # Position of the earliest match of the last step
+        rows, first = np.unique(sessions, return_index=True)
+        return rows, store.positions[hits[first]]
+
+    def _next(self, rows, state, code, depth, strict):
+        store = self.store
+        if strict:
+            sessions, starts = state
+            inside = starts + depth < store.lengths[sessions]
+            sessions, starts = sessions[inside], starts[inside]
+            keep = store.codes[store.offsets[sessions] + starts + depth] == code
+            sessions, starts = sessions[keep], starts[keep]
+            return np.unique(sessions), (sessions, starts)
+        # The pages after each session's match, gathered as one flat run
+        begin = store.offsets[rows] + state + 1
+        lengths = store.offsets[rows + 1] - begin
+        index = np.repeat(begin - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        hits = np.flatnonzero(store.codes[index] == code)
+        owner = np.repeat(np.arange(len(rows)), lengths)[hits]
+        keep, first = np.unique(owner, return_index=True)
+        return rows[keep], store.positions[index[hits[first]]]
+
+    def reached(self, steps, strict=False):
+        """Indices of the sessions reaching each step, one array per step."""
+        codes = self.store.page_codes(steps)
+        reached = []
+        for depth, code in enumerate(codes):
+            key = (strict, tuple(codes[:depth + 1].tolist()))
+            with self._lock:
+                prefix = self._prefixes.get(key)
+            if prefix is None:
+                if code < 0:
+                    prefix = np.array([], dtype=np.int64), None
+                elif depth == 0:
+                    prefix = self._first(code, strict)
+                elif len(reached[-1]):
+                    prefix = self._next(*previous, code, depth, strict)
+                else:
+                    prefix = reached[-1], None
+                with self._lock:
+                    while len(self._prefixes) >= MAX_PREFIXES:
+                        del self._prefixes[next(iter(self._prefixes))]
+                    self._prefixes[key] = prefix
+            previous = prefix
+            reached.append(prefix[0])
+        return reached
+
+    @profiled
+    def table(self, steps, strict=False):
+        """Sessions reaching each step per (Source, Device), with 'all' roll-ups.
+
+        Columns are the numbered steps; sessions without a Source or Device
+        are left out, as in the KPI table.
+        """
+        store = self.store
+        n_sources, n_devices = len(store.sources), len(store.devices)
+        size = n_sources * n_devices
+        cube = np.zeros((size, len(steps)), dtype=np.int64)
+        for i, rows in enumerate(self.reached(steps, strict)):
+            source, device = store.source_codes[rows], store.device_codes[rows]
+            valid = (source >= 0) & (device >= 0)
+            group = source[valid].astype(np.int64) * n_devices + device[valid]
+            cube[:, i] = np.bincount(group, minlength=size)
+        columns = [f"{i + 1}. {step}" for i, step in enumerate(steps)]
+        return rollup(store.sources, store.devices, cube.reshape(n_sources, n_devices, len(steps)), columns)
+
+
+def funnel_engine(store):
+    """The funnel engine of a store, built on first use and kept alongside it."""
+    engine = _engines.get(store)
+    if engine is None:
+        engine = _engines[store] = FunnelEngine(store)
+    return engine
+
+
+def step_conversion(table):
+    """Percentage of the sessions at each step that went on to the next one."""
+    counts = table.to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(counts[:, :-1] > 0, counts[:, 1:] / counts[:, :-1] * 100, 0.0)
+    return pd.DataFrame(rates, index=table.index, columns=table.columns[1:])
@@ -0,0 +1,159 @@
+"""Incremental ingestion of hourly clickstream drops.
+
+The aggregate state (KPI counters, drop-off tallies, transitions and path
+counts) is persisted in ``STATE_DIR`` together with a manifest of every file
+already folded into it. A refresh only reads files that are not in the
+manifest yet, so its cost follows the size of the new delta. Drops are
+picked up once they have not been modified for ``SETTLE_SECONDS``, so a
+file still being copied in is left for a later refresh.
+"""
+import glob
+import json
+import os
+import pickle
+import threading
+import time
+import warnings
+
+from clickstream.loader import file_key
+from clickstream.profiling import profiled
+from clickstream.streaming import CHUNK_SIZE, Aggregates, aggregate_file
+
+INCOMING_DIR = "data/incoming"
+STATE_DIR = "data/.state"
+MANIFEST = "manifest.json"
+AGGREGATES = "aggregates.pkl"
+SETTLE_SECONDS = 60  # drops modified more recently than this are still being written
+
+_states = {}
+_lock = threading.RLock()
+
+
+def _write_atomic(path, data, mode):
+    tmp = path + ".tmp"
+    with open(tmp, mode) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class IncrementalState:
+    """Persisted aggregates plus the manifest of files they cover."""
+
+    def __init__(self, directory=STATE_DIR, aggregates=None, manifest=None):
+        self.directory = directory
+        self.aggregates = aggregates if aggregates is not None else Aggregates()
+        self.manifest = manifest if manifest is not None else {}
+
+    @classmethod
+    def load(cls, directory=STATE_DIR):
+        """Opens the state in ``directory``, empty when nothing was ingested yet."""
+        manifest_path = os.path.join(directory, MANIFEST)
+        if not os.path.exists(manifest_path):
+            return cls(directory)
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        with open(os.path.join(directory, AGGREGATES), 'rb') as f:
+            aggregates = pickle.load(f)
+        return cls(directory, aggregates, manifest)
+
+    def save(self):
+        # Aggregates first: a manifest never lists files missing from the aggregates
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(os.path.join(self.directory, AGGREGATES), pickle.dumps(self.aggregates), 'wb')
+        _write_atomic(os.path.join(self.directory, MANIFEST), json.dumps(self.manifest, indent=2), 'w')
+
+    def pending(self, paths):
+        """Files not yet ingested, in the given order.
+
+        Raises ValueError for an ingested file whose size or mtime changed,
+        since its old contribution cannot be taken back out of the counters.
+        """
+        changed = self.changed(paths)
+        if changed:
+            raise ValueError(f"Already ingested files changed on disk, rebuild the state: {changed}")
+        return [path for path in paths if file_key(path)[0] not in self.manifest]
+
+    def changed(self, paths):
+        """Ingested files whose size or mtime no longer match the manifest."""
+        changed = []
+        for path in paths:
+            key, mtime_ns, size = file_key(path)
+            entry = self.manifest.get(key)
+            if entry is not None and (entry['mtime_ns'], entry['size']) != (mtime_ns, size):
+                changed.append(path)
+        return changed
+
+    @profiled
+    def ingest(self, paths, chunksize=CHUNK_SIZE, workers=None):
+        """Folds every new file in ``paths`` into the state and persists it.
+
+        The files are merged into a copy that replaces the current aggregates
+        once all of them are in, so readers of the old aggregates never see a
+        partial merge, and a failing file leaves the state as it was.
+        """
+        new = self.pending(paths)
+        if not new:
+            return new
+        aggregates, manifest = self.aggregates.copy(), dict(self.manifest)
+        for path in new:
+            key, mtime_ns, size = file_key(path)
+            delta = aggregate_file(path, chunksize, workers)
+            aggregates.merge(delta)
+            manifest[key] = {
+                'mtime_ns': mtime_ns,
+                'size': size,
+                'sessions': int(delta.counts['sessions'].sum()),
+                'ingested_at': time.time(),
+            }
+        with _lock:
+            self.aggregates, self.manifest = aggregates, manifest
+        self.save()
+        return new
+
+
+def incoming_files(directory=INCOMING_DIR, settle=SETTLE_SECONDS):
+    """Settled CSV drops in ``directory``, oldest name first.
+
+    Files modified within the last ``settle`` seconds are left out.
+    """
+    cutoff = time.time() - settle
+    return sorted(path for path in glob.glob(os.path.join(directory, "*.csv")) if os.path.getmtime(path) <= cutoff)
+
+
+def use_incremental(directory=INCOMING_DIR):
+    """Whether the dashboards should render from the incremental state."""
+    return os.path.isdir(directory)
+
+
+def refresh(directory=INCOMING_DIR, state_dir=STATE_DIR):
+    """Ingests new drops from ``directory`` and returns the up-to-date aggregates.
+
+    The state is read from disk once per process; later refreshes only stat
+    the incoming directory unless a new file arrived. Drops that changed
+    after ingestion are skipped and a failing ingest leaves the state as it
+    was, to be retried on the next refresh; both are reported as warnings while the current
+    aggregates keep being served.
+    """
+    with _lock:
+        state = _states.get(state_dir)
+        if state is None:
+            state = _states[state_dir] = IncrementalState.load(state_dir)
+        paths = incoming_files(directory)
+        changed = state.changed(paths)
+        if changed:
+            warnings.warn(f"Ignoring drops that changed after ingestion, rebuild the state to include them: {changed}",
+                          RuntimeWarning)
+        try:
+            state.ingest([path for path in paths if path not in changed])
+        except Exception as e:
+            warnings.warn(f"Could not ingest the new drops, serving the current state: {e}", RuntimeWarning)
+        return state.aggregates
+
+
+def incoming_version(directory=INCOMING_DIR, state_dir=STATE_DIR):
+    """Identifies the aggregates ``refresh`` would return, without ingesting anything.
+
+    Files are only ever added to the state, so the settled drops and their
+    versions determine it.
+    """
+    return (os.path.abspath(state_dir), tuple(file_key(path) for path in incoming_files(directory)))
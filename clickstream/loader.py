@@ -0,0 +1,137 @@
+"""Shared loading of the clickstream export.
+
+Every page reads the same headerless ``Source, Device, Link 1..Link 16`` file.
+It is parsed once per process for each version of the file (path, mtime and
+size), and a typed Parquet copy is written next to it so that later cold
+starts skip the CSV parser entirely.
+"""
+import os
+import re
+import shutil
+import threading
+
+import pandas as pd
+
+from clickstream.profiling import profiled
+
+DATA_PATH = "data/clickstream_data.csv"
+LINK_COLS = [f"Link {i}" for i in range(1, 17)]
+HEADERS = ["Source", "Device"] + LINK_COLS
+CACHE_DIR = ".cache"
+
+_cache = {}
+_building = {}  # a lock per entry being built
+_lock = threading.Lock()
+
+
+def file_key(path):
+    """Identifies one version of a file by absolute path, mtime and size."""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def read_csv(path, **kwargs):
+    """Parses a raw export with the column layout used by every page."""
+    return pd.read_csv(path, on_bad_lines='skip', names=HEADERS, encoding='utf-8', **kwargs)
+
+
+def to_typed(df):
+    """Converts a raw frame to categoricals, with one shared page vocabulary."""
+    links = df[LINK_COLS].to_numpy().ravel()
+    page_dtype = pd.CategoricalDtype(sorted(pd.unique(links[pd.notna(links)])))
+    typed = pd.DataFrame({
+        "Source": df["Source"].astype("category"),
+        "Device": df["Device"].astype("category"),
+    })
+    for col in LINK_COLS:
+        typed[col] = df[col].astype(page_dtype)
+    return typed
+
+
+def sidecar_path(key, extension="parquet"):
+    """Location of a derived copy (Parquet frame, mapped store) for one version of a file."""
+    path, mtime_ns, size = key
+    folder = os.path.join(os.path.dirname(path), CACHE_DIR)
+    return os.path.join(folder, f"{os.path.basename(path)}.{mtime_ns}-{size}.{extension}")
+
+
+def remove_stale(key, extension):
+    """Removes the derived copies of older versions of the same file."""
+    current = sidecar_path(key, extension)
+    folder = os.path.dirname(current)
+    # <file name>.<mtime_ns>-<size>.<extension>, and no sibling export's copies
+    pattern = re.compile(re.escape(os.path.basename(key[0])) + r"\.\d+-\d+\." + re.escape(extension))
+    for name in os.listdir(folder):
+        old = os.path.join(folder, name)
+        if pattern.fullmatch(name) and old != current:
+            # Processes that still map an old store keep it until they let go
+            shutil.rmtree(old) if os.path.isdir(old) else os.remove(old)
+
+
+def _read_sidecar(key):
+    sidecar = sidecar_path(key)
+    if not os.path.exists(sidecar):
+        return None
+    try:
+        return pd.read_parquet(sidecar)
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+def _write_sidecar(key, df):
+    sidecar = sidecar_path(key)
+    tmp = sidecar + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, sidecar)
+        # Older versions of the same export are never read again
+        remove_stale(key, "parquet")
+    except (ImportError, ValueError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def cached(path, kind, build):
+    """Returns ``build()`` memoized per process for the current version of ``path``.
+
+    Each entry is built once under its own lock, so a slow build only holds
+    up callers waiting for that same entry. Entries for older versions of
+    the same file are evicted when it changes.
+    """
+    entry = (file_key(path), kind)
+    with _lock:
+        if entry in _cache:
+            return _cache[entry]
+        building = _building.setdefault(entry, threading.RLock())
+    with building:
+        with _lock:
+            if entry in _cache:
+                return _cache[entry]
+        value = build()
+        with _lock:
+            key = entry[0]
+            for old in [k for k in _cache if k[0][0] == key[0] and k[0] != key]:
+                del _cache[old]
+            _cache[entry] = value
+            _building.pop(entry, None)
+        return value
+
+
+def _load_typed(path):
+    key = file_key(path)
+    df = _read_sidecar(key)
+    if df is None:
+        df = to_typed(read_csv(path))
+        _write_sidecar(key, df)
+    return df
+
+
+@profiled
+def load_clickstream(path=DATA_PATH):
+    """Returns the typed clickstream frame, parsing the CSV at most once per version.
+
+    The returned frame is a shallow copy, so callers may add or drop columns
+    without affecting other pages or sessions.
+    """
+    return cached(path, "frame", lambda: _load_typed(path)).copy(deep=False)
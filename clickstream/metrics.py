@@ -0,0 +1,185 @@
+"""Campaign metrics computed over a ``SessionStore``.
+
+These are the functions the dashboards used to define inline over the list
+``path`` column. They keep their names and filter arguments, but every
+"contains page", length and first/last page test is a vectorized lookup on
+the encoded paths. Bounce, drop-off and page conversion rates are read from
+the store's ``SessionCube``, so any filter combination only sums cube cells.
+Every function also accepts a ``SessionDatabase``, and then runs as SQL.
+"""
+import weakref
+
+import numpy as np
+
+from clickstream.cube import SessionCube
+from clickstream.database import SessionDatabase
+from clickstream.profiling import profiled
+from clickstream.sessions import _as_list
+
+CONVERSION_PAGE = 'purchase_success'
+
+_cubes = weakref.WeakKeyDictionary()
+
+
+def session_cube(store):
+    """The count cube of a store, built on first use and kept alongside it."""
+    cube = _cubes.get(store)
+    if cube is None:
+        cube = _cubes[store] = SessionCube.from_store(store, CONVERSION_PAGE)
+    return cube
+
+
+def _rate(hits, total):
+    return (hits / total) * 100
+
+
+def _group_rates(store, mask, hits):
+    """Percentage of ``hits`` per (Source, Device) among the masked sessions."""
+    n_devices = len(store.devices)
+    group = store.source_codes[mask].astype(np.int64) * n_devices + store.device_codes[mask]
+    valid = (store.source_codes[mask] >= 0) & (store.device_codes[mask] >= 0)
+    size = len(store.sources) * n_devices
+    totals = np.bincount(group[valid], minlength=size)
+    counts = np.bincount(group[valid], weights=hits[mask][valid], minlength=size)
+    rates = {}
+    for g in np.flatnonzero(totals):
+        source, device = divmod(int(g), n_devices)
+        rates[(store.sources[source], store.devices[device])] = _rate(counts[g], totals[g])
+    return rates
+
+
+@profiled
+def bounce_rate_by_source(store):
+    """Percentage of single-page sessions for each Source."""
+    if isinstance(store, SessionDatabase):
+        return store.bounce_rate_by_source()
+    single_page = store.lengths < 2
+    totals = np.bincount(store.source_codes[store.source_codes >= 0], minlength=len(store.sources))
+    bounces = np.bincount(store.source_codes[single_page & (store.source_codes >= 0)], minlength=len(store.sources))
+    return {store.sources[s]: _rate(bounces[s], totals[s]) for s in np.flatnonzero(totals)}
+
+
+@profiled
+def bounce_rate_by_source_device(store, selected_sources=None, selected_devices=None):
+    """Calculates bounce rate by source and device, with filtering options.
+
+    Besides one entry per (source, device) there is a (source, 'all') entry
+    with the bounce rate over all devices of that source.
+    """
+    if isinstance(store, SessionDatabase):
+        return store.bounce_rate_by_source_device(selected_sources, selected_devices)
+    cube = session_cube(store)
+    mask = cube.mask(sources=_as_list(selected_sources), devices=_as_list(selected_devices))
+    mask &= (cube.cells['source'] >= 0) & (cube.cells['device'] >= 0)
+    bounces = mask & (cube.cells['length'] == 1)
+
+    totals = cube.totals(mask, ['source', 'device'])
+    single_page = cube.totals(bounces, ['source', 'device'])
+    bounce_rates = {}
+    for (source, device), total in totals.items():
+        bounce_rates[(store.sources[source], store.devices[device])] = _rate(single_page.get((source, device), 0), total)
+
+    totals = cube.totals(mask, 'source')
+    single_page = cube.totals(bounces, 'source')
+    for source, total in totals.items():
+        bounce_rates[(store.sources[source], 'all')] = _rate(single_page.get(source, 0), total)
+    return bounce_rates
+
+
+@profiled
+def avg_links_to_purchase(store, selected_source=None):
+    """Average path length of converting sessions."""
+    if isinstance(store, SessionDatabase):
+        return store.avg_links_to_purchase(selected_source, CONVERSION_PAGE)
+    successful = store.source_mask(selected_source) & store.contains(CONVERSION_PAGE)
+    if successful.any():
+        return store.lengths[successful].mean()
+    else:
+        return 0
+
+
+@profiled
+def calculate_purchase_success_rate(store, selected_source=None):
+    """Percentage of sessions that reach the purchase success page."""
+    if isinstance(store, SessionDatabase):
+        return store.calculate_purchase_success_rate(selected_source, CONVERSION_PAGE)
+    mask = store.source_mask(selected_source)
+    if mask.any():
+        return _rate(store.contains(CONVERSION_PAGE)[mask].sum(), mask.sum())
+    else:
+        return 0
+
+
+@profiled
+def avg_links_visited_by_source(store, selected_sources=None):
+    """Average number of pages visited per session."""
+    if isinstance(store, SessionDatabase):
+        return store.avg_links_visited_by_source(selected_sources)
+    mask = store.source_mask(selected_sources)
+    if mask.any():
+        return store.lengths[mask].mean()
+    else:
+        return 0
+
+
+@profiled
+def conversion_rate_by_device(store, selected_sources=None):
+    """Conversion rate per Device for the selected sources."""
+    if isinstance(store, SessionDatabase):
+        return store.conversion_rate_by_device(selected_sources, CONVERSION_PAGE)
+    mask = store.source_mask(selected_sources)
+    if not mask.any():
+        return {}
+    converted = store.contains(CONVERSION_PAGE)
+    codes = store.device_codes[mask & (store.device_codes >= 0)]
+    totals = np.bincount(codes, minlength=len(store.devices))
+    hits = np.bincount(store.device_codes[mask & converted & (store.device_codes >= 0)], minlength=len(store.devices))
+    return {store.devices[d]: _rate(hits[d], totals[d]) for d in np.flatnonzero(totals)}
+
+
+@profiled
+def conversion_rate_by_page(store, selected_sources=None, pages=None):
+    """Conversion rate of sessions whose last page is one of ``pages``."""
+    if isinstance(store, SessionDatabase):
+        return store.conversion_rate_by_page(selected_sources, pages, CONVERSION_PAGE)
+    cube = session_cube(store)
+    mask = cube.mask(sources=_as_list(selected_sources), last_pages=_as_list(pages))
+    total = cube.count(mask)
+    if total:
+        return _rate(cube.count(mask & (cube.cells['converted'] == 1)), total)
+    else:
+        return 0
+
+
+@profiled
+def conversion_rate_by_first_page(store, selected_sources=None, pages=None):
+    """Conversion rate of sessions whose first page is one of ``pages``."""
+    if isinstance(store, SessionDatabase):
+        return store.conversion_rate_by_first_page(selected_sources, pages, CONVERSION_PAGE)
+    cube = session_cube(store)
+    mask = cube.mask(sources=_as_list(selected_sources), first_pages=_as_list(pages))
+    total = cube.count(mask)
+    if total:
+        return _rate(cube.count(mask & (cube.cells['converted'] == 1)), total)
+    else:
+        return 0
+
+
+@profiled
+def dropoff_page_by_source_device(store, selected_sources=None, selected_devices=None):
+    """Most common exit page per (source, device), ignoring converting exits."""
+    if isinstance(store, SessionDatabase):
+        return store.dropoff_page_by_source_device(selected_sources, selected_devices, CONVERSION_PAGE)
+    cube = session_cube(store)
+    mask = cube.mask(sources=_as_list(selected_sources), devices=_as_list(selected_devices))
+    mask &= (cube.cells['source'] >= 0) & (cube.cells['device'] >= 0)
+    dropped = mask & (cube.cells['last_page'] >= 0) & (cube.cells['last_page'] != store.page_code(CONVERSION_PAGE))
+
+    dropoff_pages = {(store.sources[s], store.devices[d]): None for s, d in cube.totals(mask, ['source', 'device'])}
+    best = {}
+    for (source, device, page), n in cube.totals(dropped, ['source', 'device', 'last_page']).items():
+        # Pages come in code (alphabetical) order, so ties keep the first page like Series.mode
+        if n > best.get((source, device), 0):
+            best[(source, device)] = n
+            dropoff_pages[(store.sources[source], store.devices[device])] = store.pages[page]
+    return dropoff_pages
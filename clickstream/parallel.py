@@ -0,0 +1,99 @@
+"""Sharded execution of the metric computations across processes.
+
+Sessions (or input chunks) are split into contiguous shards, each shard is
+computed in a process pool, and the partial results are reduced exactly:
+every partial is an integer count, so the merged result is bit-for-bit what
+the serial functions return. Inputs too small to amortize the pool run
+serially in the calling process.
+"""
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from clickstream.engine import _counts, kpi_table
+from clickstream.transitions import TransitionMatrix
+
+MIN_SESSIONS_PER_WORKER = 250_000
+# Workers are never forked from the (multithreaded) server, whose locks a
+# child could inherit held
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def worker_count(workers=None):
+    """Worker processes to use: ``workers``, ``CLICKSTREAM_WORKERS`` or every core."""
+    if workers is None:
+        workers = int(os.environ.get("CLICKSTREAM_WORKERS", 0)) or os.cpu_count() or 1
+    return max(1, workers)
+
+
+def shard_store(store, workers=None, min_sessions=MIN_SESSIONS_PER_WORKER):
+    """Splits a store into contiguous shards of at least ``min_sessions`` sessions."""
+    n_shards = max(1, min(worker_count(workers), len(store) // max(1, min_sessions)))
+    if n_shards == 1:
+        return [store]
+    bounds = np.linspace(0, len(store), n_shards + 1).astype(np.int64)
+    # Slices of a mapped store reach the workers as (directory, start, stop), not data
+    return [store.slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def _pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+
+def map_shards(func, shards, workers=None):
+    """``func`` over every shard, in a process pool when there is more than one."""
+    workers = min(worker_count(workers), len(shards))
+    if workers <= 1:
+        return [func(shard) for shard in shards]
+    with _pool(workers) as pool:
+        return list(pool.map(func, shards))
+
+
+def imap_bounded(func, items, workers=None):
+    """Lazily maps ``func`` over an iterator, yielding results in input order.
+
+    At most two tasks per worker are in flight, so a chunked reader feeding
+    this never holds more than a few chunks in memory. A single item is
+    computed in the calling process.
+    """
+    items = iter(items)
+    head = [item for _, item in zip(range(2), items)]
+    workers = worker_count(workers)
+    if workers <= 1 or len(head) < 2:
+        for item in head:
+            yield func(item)
+        for item in items:
+            yield func(item)
+        return
+    with _pool(workers) as pool:
+        pending = deque()
+        for item in itertools.chain(head, items):
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def parallel_kpis(store, workers=None, min_sessions=MIN_SESSIONS_PER_WORKER):
+    """``engine.compute_kpis`` with the counting pass sharded across processes."""
+    cubes = map_shards(_counts, shard_store(store, workers, min_sessions), workers)
+    return kpi_table(store.sources, store.devices, np.sum(cubes, axis=0))
+
+
+def parallel_transitions(store, workers=None, min_sessions=MIN_SESSIONS_PER_WORKER):
+    """``TransitionMatrix.from_store`` with the counting pass sharded across processes."""
+    shards = shard_store(store, workers, min_sessions)
+    partials = map_shards(TransitionMatrix.from_store, shards, workers)
+    if len(partials) == 1:
+        return partials[0]
+    n_states = len(store.pages) + 2
+    keys = np.concatenate([m.src * n_states + m.dst for m in partials])
+    counts = np.concatenate([m.counts for m in partials])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=counts).astype(np.int64)
+    return TransitionMatrix(partials[0].states, keys // n_states, keys % n_states, totals)
@@ -0,0 +1,139 @@
+"""Frequent sequential patterns (PrefixSpan) over the encoded paths.
+
+A pattern such as pricing -> case_study -> purchase_start is supported by
+every session that visits those pages in that order, with any pages in
+between. Patterns are grown one page at a time from pseudo-projected
+databases: for a prefix, the sessions that contain it and the offset into
+``codes`` just past its earliest match. Counting the extensions of a prefix
+is one gather of the suffixes, a pass per suffix position marking first
+visits in a per-session page bitmask, and a radix sort by page, with no
+per-session Python.
+
+The subtrees of the frequent first pages are independent and are mined in
+a process pool; a memory-mapped store reaches the workers as its location.
+"""
+import functools
+import math
+
+import numpy as np
+
+from clickstream.loader import DATA_PATH, file_key
+from clickstream.parallel import MIN_SESSIONS_PER_WORKER, map_shards
+from clickstream.profiling import profiled
+from clickstream.sessions import _as_list, load_sessions
+
+MIN_SUPPORT = 0.01  # share of the (selected) sessions a pattern must occur in
+MAX_LENGTH = 4
+MAX_CACHED = 32  # mined results kept, across files and settings
+
+
+def _first_visits(store, lengths, index):
+    """Mask of the suffix items that are the first visit of their page in their row."""
+    n_pages = len(store.pages)
+    pages = store.codes[index]
+    if n_pages > 64:
+        row = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        _, first = np.unique(row * n_pages + pages, return_index=True)
+        mask = np.zeros(len(index), dtype=bool)
+        mask[first] = True
+        return mask
+    # Pages seen so far as a bitmask per row, advanced one suffix position at a time
+    seen = np.zeros(len(lengths), dtype=np.uint64)
+    bits = np.left_shift(np.uint64(1), pages.astype(np.uint64))
+    row_starts = np.cumsum(lengths) - lengths
+    mask = np.zeros(len(index), dtype=bool)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        rows = np.flatnonzero(lengths > k)
+        items = row_starts[rows] + k
+        mask[items] = (seen[rows] & bits[items]) == 0
+        seen[rows] |= bits[items]
+    return mask
+
+
+def _extensions(store, sessions, starts):
+    """Support and first-match offsets of every page following a projected prefix.
+
+    Returns (supports, bounds, rows, offsets): the projected rows extended by
+    page ``p`` and the offsets of its earliest match in them are
+    ``rows[bounds[p]:bounds[p + 1]]`` and ``offsets[bounds[p]:bounds[p + 1]]``.
+    """
+    n_pages = len(store.pages)
+    lengths = store.offsets[sessions + 1] - starts
+    index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+    first = _first_visits(store, lengths, index)
+    rows = np.repeat(np.arange(len(sessions), dtype=np.int64), lengths)[first]
+    index = index[first]
+    pages = store.codes[index]
+    # Stable sorts of small integers are radix sorts
+    order = np.argsort(pages.astype(np.int16) if n_pages < 2 ** 15 else pages, kind='stable')
+    supports = np.bincount(pages, minlength=n_pages)
+    bounds = np.zeros(n_pages + 1, dtype=np.int64)
+    np.cumsum(supports, out=bounds[1:])
+    return supports, bounds, rows[order], index[order]
+
+
+def _grow(store, prefix, sessions, starts, min_count, max_length, patterns):
+    if len(prefix) >= max_length or not len(sessions):
+        return
+    supports, bounds, rows, offsets = _extensions(store, sessions, starts)
+    for page in np.flatnonzero(supports >= min_count):
+        pattern = prefix + (int(page),)
+        patterns.append((pattern, int(supports[page])))
+        selected = slice(bounds[page], bounds[page + 1])
+        _grow(store, pattern, sessions[rows[selected]], offsets[selected] + 1, min_count, max_length, patterns)
+
+
+def _mine_branch(page, store, sources, min_count, max_length):
+    """Every frequent pattern starting with ``page`` among the sessions of ``sources``."""
+    sessions = np.flatnonzero(store.source_mask(sources))
+    position = store.position(store.pages[page])[sessions]
+    found = position >= 0
+    sessions = sessions[found]
+    patterns = [((page,), len(sessions))]
+    _grow(store, (page,), sessions, store.offsets[sessions] + position[found] + 1, min_count, max_length, patterns)
+    return patterns
+
+
+@profiled
+def frequent_patterns(store, min_support=MIN_SUPPORT, max_length=MAX_LENGTH, sources=None, min_length=1,
+                      workers=None):
+    """Frequent subsequences of the selected sessions as (page tuple, sessions), most frequent first.
+
+    ``min_support`` is a share of the selected sessions (or a session count
+    when 1 or more). Ties break on the pattern.
+    """
+    sources = _as_list(sources)
+    sessions = np.flatnonzero(store.source_mask(sources))
+    min_count = max(1, int(min_support) if min_support >= 1 else math.ceil(min_support * len(sessions)))
+    # Page views bound session counts, so only these pages can start a frequent pattern
+    views = np.bincount(store.codes[np.isin(store.session_index, sessions)], minlength=len(store.pages))
+    pages = [int(page) for page in np.flatnonzero(views >= min_count)]
+    mine = functools.partial(_mine_branch, store=store, sources=sources, min_count=min_count, max_length=max_length)
+    if len(sessions) < MIN_SESSIONS_PER_WORKER or store.mapped is None:
+        workers = 1  # too small to amortize a pool, or too costly to ship an unmapped store
+    patterns = [
+        (tuple(store.pages[list(pattern)]), count)
+        for branch in map_shards(mine, pages, workers) for pattern, count in branch
+        if count >= min_count and len(pattern) >= min_length
+    ]
+    return sorted(patterns, key=lambda item: (-item[1], item[0]))
+
+
+def patterns_by_source(store, min_support=MIN_SUPPORT, max_length=MAX_LENGTH, min_length=1, workers=None):
+    """``frequent_patterns`` mined separately within each Source."""
+    return {source: frequent_patterns(store, min_support, max_length, [source], min_length, workers)
+            for source in store.sources}
+
+
+@functools.lru_cache(maxsize=MAX_CACHED)
+def _load_patterns(key, min_support, max_length, sources, min_length):
+    return frequent_patterns(load_sessions(key[0]), min_support, max_length, list(sources), min_length)
+
+
+def load_patterns(path=DATA_PATH, min_support=MIN_SUPPORT, max_length=MAX_LENGTH, sources=None, min_length=1):
+    """Frequent patterns for the export at ``path``, mined once per file version and settings.
+
+    Only the ``MAX_CACHED`` most recently used results are kept.
+    """
+    sources = tuple(sorted(_as_list(sources) or []))
+    return _load_patterns(file_key(path), min_support, max_length, sources, min_length)
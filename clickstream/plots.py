@@ -0,0 +1,94 @@
+"""Chart data and rendering for the plots page.
+
+Every chart is drawn from a compact count table taken from ``Aggregates``
+(a few rows per Source, Device, length or page pair), never from session
+rows, so rendering cost does not grow with the export. Renderers return
+PNG bytes or a plotly figure, which the page caches on the table content.
+matplotlib and plotly are imported only when a chart is drawn.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from clickstream.engine import ALL
+from clickstream.transitions import EXIT, START
+
+SANKEY_LINKS = 30  # transitions drawn in the Sankey
+
+
+def session_counts(aggregates, level):
+    """Sessions per Source or Device."""
+    return aggregates.counts['sessions'].groupby(level=level).sum().sort_values(ascending=False)
+
+
+def conversion_grid(kpis, include_all=True):
+    """Conversion rate per Source (rows) and Device (columns)."""
+    grid = kpis['conversion_rate'].unstack('Device').fillna(0.0)
+    if not include_all:
+        return grid.drop(index=ALL, columns=ALL, errors='ignore')
+    # Roll-ups go last, after the sorted labels
+    last = lambda labels: [label for label in labels if label != ALL] + [label for label in labels if label == ALL]
+    return grid.loc[last(grid.index), last(grid.columns)]
+
+
+def sankey_links(transitions, top=SANKEY_LINKS, include_entry_exit=False):
+    """The ``top`` most frequent page -> page transitions as (from, to, count) rows."""
+    links = transitions.to_frame()[['from', 'to', 'count']]
+    if not include_entry_exit:
+        links = links[~links['from'].isin([START, EXIT]) & ~links['to'].isin([START, EXIT])]
+    return links.sort_values(['count', 'from', 'to'], ascending=[False, True, True]).head(top).reset_index(drop=True)
+
+
+def _png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def bar_png(counts, title, xlabel, ylabel="Sessions"):
+    """Bar chart of a count Series."""
+    from matplotlib.figure import Figure  # no pyplot: figures are not shared between sessions
+
+    fig = Figure()
+    ax = fig.subplots()
+    counts.plot(kind='bar', ax=ax)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return _png(fig)
+
+
+def heatmap_png(grid, title, label="%"):
+    """Annotated heatmap of a numeric DataFrame."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(1.2 * len(grid.columns) + 2, 0.5 * len(grid) + 1.5))
+    ax = fig.subplots()
+    image = ax.imshow(grid.to_numpy(), cmap='viridis', aspect='auto')
+    ax.set_xticks(np.arange(len(grid.columns)), labels=grid.columns)
+    ax.set_yticks(np.arange(len(grid)), labels=grid.index)
+    for (row, column), value in np.ndenumerate(grid.to_numpy()):
+        ax.text(column, row, f"{value:.1f}", ha='center', va='center', color='white', fontsize=8)
+    ax.set_title(title)
+    fig.colorbar(image, ax=ax, label=label)
+    return _png(fig)
+
+
+def sankey_figure(links):
+    """plotly Sankey of transitions, pages left as origins and right as targets.
+
+    Raises ImportError when plotly is not installed.
+    """
+    import plotly.graph_objects as go
+
+    origins = list(pd.unique(links['from']))
+    targets = list(pd.unique(links['to']))
+    nodes = [f"{page} →" for page in origins] + [f"→ {page}" for page in targets]
+    source = [origins.index(page) for page in links['from']]
+    target = [len(origins) + targets.index(page) for page in links['to']]
+    return go.Figure(go.Sankey(
+        node=dict(label=nodes, pad=12),
+        link=dict(source=source, target=target, value=links['count'].tolist()),
+    ))
+
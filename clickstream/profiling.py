@@ -0,0 +1,163 @@
+"""Hot-path instrumentation for dashboard reruns.
+
+A page activates a ``Profiler`` at the top of every rerun. Code wrapped in
+``step(...)`` or decorated with ``@profiled`` then records its wall time,
+rows scanned and, when memory tracing is on, the peak memory it allocated.
+The profiler keeps a rolling history of reruns, can append each one to a
+JSON lines file, and can render itself in the Streamlit sidebar. Without an
+active profiler the hooks cost one context variable lookup.
+"""
+import contextvars
+import functools
+import json
+import os
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+HISTORY = 50  # reruns kept per profiler
+LOG_ENV = "CLICKSTREAM_PROFILE_LOG"  # JSON lines file every finished rerun is appended to
+MEMORY_ENV = "CLICKSTREAM_PROFILE_MEMORY"  # set to 1 to trace peak memory (slower)
+
+_active = contextvars.ContextVar("clickstream_profiler", default=None)
+
+
+class Profiler:
+    """Per-step timings of the current rerun plus a rolling history of past reruns."""
+
+    def __init__(self, history=HISTORY, trace_memory=None, log_path=None):
+        self.history = deque(maxlen=history)
+        self.trace_memory = os.environ.get(MEMORY_ENV) == "1" if trace_memory is None else trace_memory
+        self.log_path = os.environ.get(LOG_ENV) if log_path is None else log_path
+        self.run = None
+        self._stack = []
+
+    def start_run(self, page):
+        """Starts recording a rerun of ``page`` and makes this the active profiler."""
+        if self.run is not None:
+            self.end_run()
+        self.run = {'page': page, 'started_at': time.time(), 'seconds': 0.0, 'steps': []}
+        self._started = time.perf_counter()
+        self._stack = []
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _active.set(self)
+        return self
+
+    def end_run(self):
+        """Closes the current rerun, adds it to the history and the JSON lines log."""
+        run, self.run = self.run, None
+        if run is None:
+            return None
+        run['seconds'] = time.perf_counter() - self._started
+        self.history.append(run)
+        if self.log_path:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(run) + '\n')
+        return run
+
+    @contextmanager
+    def step(self, name, rows=None):
+        """Records one step of the current rerun; steps may nest.
+
+        Yields the step's record so the caller can fill in ``rows`` late.
+        """
+        record = {'name': name, 'depth': len(self._stack), 'seconds': None, 'rows': rows, 'peak_bytes': None}
+        if self.run is None:
+            yield record
+            return
+        self.run['steps'].append(record)
+        entry = {'child_peak': 0}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            entry['memory_at_start'] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self._stack.pop()
+            if tracing:
+                # Nested steps reset the peak, so fold their peaks back in
+                peak = max(tracemalloc.get_traced_memory()[1], entry['child_peak'])
+                record['peak_bytes'] = max(0, peak - entry['memory_at_start'])
+                if self._stack:
+                    self._stack[-1]['child_peak'] = max(self._stack[-1]['child_peak'], peak)
+
+    def last_run(self):
+        return self.history[-1] if self.history else None
+
+    def export_jsonl(self, path):
+        """Writes the whole rerun history to ``path`` as JSON lines."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for run in self.history:
+                f.write(json.dumps(run) + '\n')
+
+
+def active():
+    """The profiler recording the current rerun, if any."""
+    return _active.get()
+
+
+@contextmanager
+def step(name, rows=None):
+    """Records a step on the active profiler; a no-op when none is active."""
+    profiler = _active.get()
+    if profiler is None:
+        yield {}
+    else:
+        with profiler.step(name, rows) as record:
+            yield record
+
+
+def _rows(value):
+    if isinstance(value, (str, type)) or not hasattr(value, '__len__'):
+        return None
+    return len(value)
+
+
+def profiled(func):
+    """Records every call of ``func`` as a step.
+
+    Rows scanned is the ``len`` of the first data argument (``cls`` and
+    paths are skipped), or of the result when there is none.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _active.get()
+        if profiler is None:
+            return func(*args, **kwargs)
+        rows = next((n for n in map(_rows, args) if n is not None), None)
+        with profiler.step(func.__qualname__, rows) as record:
+            result = func(*args, **kwargs)
+            if record['rows'] is None:
+                record['rows'] = _rows(result)
+            return result
+    return wrapper
+
+
+def render_sidebar(profiler):
+    """Shows the last rerun's steps and the rerun latency history in the sidebar."""
+    import pandas as pd
+    import streamlit as st
+
+    run = profiler.last_run()
+    with st.sidebar:
+        st.header("Performance")
+        if run is None:
+            st.caption("No finished rerun yet.")
+            return
+        st.metric("Last rerun", f"{run['seconds'] * 1000:.0f} ms")
+        if not run['steps']:
+            return
+        steps = pd.DataFrame(run['steps'])
+        steps['step'] = ['  ' * depth + name for depth, name in zip(steps['depth'], steps['name'])]
+        steps['ms'] = steps['seconds'] * 1000
+        columns = ['step', 'ms', 'rows'] + (['peak_bytes'] if profiler.trace_memory else [])
+        st.dataframe(steps[columns], hide_index=True)
+        st.line_chart(pd.DataFrame({'rerun ms': [r['seconds'] * 1000 for r in profiler.history]}))
+        st.download_button("Download JSON lines", "".join(json.dumps(r) + "\n" for r in profiler.history),
+                           file_name="reruns.jsonl")
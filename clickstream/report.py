@@ -0,0 +1,96 @@
+"""Campaign, platform and source KPI reports, independent of Streamlit.
+
+``report_tables`` slices the tidy KPI table of an ``Aggregates`` into the
+tables the main page shows; ``write_report`` saves them as JSON, CSV or
+Parquet files. ``clickstream.cli`` runs both over many exports.
+"""
+import json
+import os
+
+import pandas as pd
+
+from clickstream.engine import ALL
+from clickstream.streaming import aggregate_file
+
+CAMPAIGN_SOURCES = ['facebook_advert', 'linkedin_advert', 'partner_advert']
+KPI_COLUMNS = ['sessions', 'bounce_rate', 'conversion_rate', 'avg_links', 'avg_links_to_purchase']
+FORMATS = ['json', 'csv', 'parquet']
+
+
+def _rollup(kpis, level):
+    """The 'all' rows of one level, without it; unlike ``xs`` empty when there are none."""
+    return kpis[kpis.index.get_level_values(level) == ALL].droplevel(level)
+
+
+def report_tables(aggregates, campaign_sources=CAMPAIGN_SOURCES):
+    """Campaign, platform, source and drop-off tables as DataFrames.
+
+    An export without valid sessions gets empty tables.
+    """
+    kpis = aggregates.kpis()
+    sources = _rollup(kpis, 'Device')
+    campaign = kpis[kpis.index.get_level_values('Source').isin(campaign_sources)]
+    dropoffs = aggregates.dropoff_pages(selected_sources=campaign_sources)
+    return {
+        'campaign': campaign[KPI_COLUMNS].reset_index(),
+        'platform': _rollup(kpis, 'Source')[KPI_COLUMNS].reset_index(),
+        'source': sources.drop(ALL, errors='ignore')[KPI_COLUMNS].reset_index(),
+        'dropoff': pd.DataFrame(
+            [(source, device, page) for (source, device), page in sorted(dropoffs.items())],
+            columns=['Source', 'Device', 'dropoff_page']),
+    }
+
+
+def write_report(tables, output_dir, name, fmt='json'):
+    """Writes ``tables`` under ``output_dir``; returns the paths written.
+
+    JSON reports are one ``<name>.json`` file holding every table, CSV and
+    Parquet reports one ``<name>_<table>`` file per table.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if fmt == 'json':
+        path = os.path.join(output_dir, f'{name}.json')
+        report = {table: json.loads(frame.to_json(orient='records')) for table, frame in tables.items()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        return [path]
+    paths = []
+    for table, frame in tables.items():
+        path = os.path.join(output_dir, f'{name}_{table}.{fmt}')
+        if fmt == 'csv':
+            frame.to_csv(path, index=False)
+        elif fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            raise ValueError(f"Unknown report format: {fmt}")
+        paths.append(path)
+    return paths
+
+
+def report_names(paths):
+    """Distinct report names for ``paths``: their paths below the common directory, without extension.
+
+    ``a/clicks.csv`` and ``b/clicks.csv`` become ``a__clicks`` and ``b__clicks``.
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ''
+    names, seen = [], set()
+    for path in paths:
+        name = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, '__')
+        base, n = name, 1
+        while name in seen:  # same path, or only the extension differed
+            n += 1
+            name = f'{base}_{n}'
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def report_file(path, output_dir, fmt='json', name=None):
+    """Aggregates one export in the calling process and writes its report.
+
+    ``name`` defaults to the file name without its extension.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    return write_report(report_tables(aggregate_file(path, workers=1)), output_dir, name, fmt)
@@ -0,0 +1,65 @@
+"""Background computation of dashboard sections.
+
+A page submits the computation behind every tab as soon as its data is
+loaded. They run in a small thread pool shared by every browser session
+(the heavy loops are numpy and pandas, which release the GIL) while the
+page renders, and each tab waits only for its own results, so the first
+tab paints without waiting on the others.
+
+Results are memoized under (data version, section, filters) keys with
+least-recently-used eviction: a widget change resubmits only the sections
+whose filters changed, and everything else comes back finished.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_ENTRIES = 128
+WORKERS = 4
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+class Scheduler:
+    """Runs keyed computations in background threads, keeping the recent results."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, workers=WORKERS):
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clickstream-scheduler")
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def submit(self, key, func, *args, **kwargs):
+        """Future of ``func(*args, **kwargs)``, started only if ``key`` is not memoized.
+
+        A computation that raised is started again on the next submit.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._futures[key] = self._pool.submit(func, *args, **kwargs)
+            self._futures.move_to_end(key)
+            while len(self._futures) > self.max_entries:
+                # An evicted computation still finishes for whoever holds its future
+                self._futures.popitem(last=False)
+            return future
+
+    def result(self, key, func, *args, **kwargs):
+        """``submit`` and wait for the result."""
+        return self.submit(key, func, *args, **kwargs).result()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shared_scheduler():
+    """The scheduler shared by every page and session of this process."""
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
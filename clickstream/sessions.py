@@ -0,0 +1,275 @@
+"""Integer-coded session paths.
+
+A ``SessionStore`` keeps every session path as int32 page codes into a shared
+vocabulary, laid out CSR-style: ``codes[offsets[i]:offsets[i + 1]]`` is the
+path of session ``i``. Source and Device are kept as categorical codes. All
+helpers answer their question for every session at once with NumPy.
+
+``load_sessions`` saves the arrays once per file version as ``.npy`` files
+and memory-maps them read-only, so every Streamlit session and worker
+process shares one copy through the OS page cache. Mapped stores (and
+contiguous slices of them) pickle as their location rather than their data.
+"""
+import json
+import os
+import shutil
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from clickstream.loader import DATA_PATH, LINK_COLS, cached, file_key, load_clickstream, remove_stale, sidecar_path
+from clickstream.profiling import profiled
+
+# Arrays written by ``SessionStore.save``; the last three are derived but mapped too
+MAPPED_ARRAYS = ['codes', 'offsets', 'source_codes', 'device_codes', 'lengths', 'session_index', 'positions']
+LABELS_FILE = 'labels.json'
+
+
+def _as_list(values):
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return [values]
+    return list(values)
+
+
+class SessionStore:
+    """Page vocabulary, CSR page codes and categorical Source/Device codes."""
+
+    def __init__(self, pages, codes, offsets, sources, source_codes, devices, device_codes):
+        self.pages = np.asarray(pages, dtype=object)
+        self.codes = codes
+        self.offsets = offsets
+        self.sources = np.asarray(sources, dtype=object)
+        self.source_codes = source_codes
+        self.devices = np.asarray(devices, dtype=object)
+        self.device_codes = device_codes
+        # (directory, start, stop) when the arrays are mapped from a saved store
+        self.mapped = None
+
+    @classmethod
+    @profiled
+    def from_frame(cls, df):
+        """Encodes a frame with Source, Device and Link 1..Link 16 columns."""
+        links = df[LINK_COLS]
+        dtype = links.dtypes.iloc[0]
+        if isinstance(dtype, pd.CategoricalDtype) and all(dt == dtype for dt in links.dtypes):
+            # Typed frames from the loader already share one page vocabulary
+            pages = np.asarray(dtype.categories, dtype=object)
+            matrix = np.column_stack([links[col].cat.codes.to_numpy() for col in LINK_COLS])
+        else:
+            flat, pages = pd.factorize(links.to_numpy().ravel(), sort=True)
+            matrix = flat.reshape(len(links), len(LINK_COLS))
+            pages = np.asarray(pages, dtype=object)
+        present = matrix >= 0
+        offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(present.sum(axis=1), out=offsets[1:])
+        codes = matrix[present].astype(np.int32)
+
+        source = pd.Categorical(df["Source"])
+        device = pd.Categorical(df["Device"])
+        return cls(pages, codes, offsets,
+                   source.categories, source.codes.astype(np.int16),
+                   device.categories, device.codes.astype(np.int16))
+
+    def save(self, directory):
+        """Writes the arrays and labels under ``directory``, atomically."""
+        tmp = f"{directory}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for name in MAPPED_ARRAYS:
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(self, name)))
+        labels = {'pages': self.pages.tolist(), 'sources': self.sources.tolist(), 'devices': self.devices.tolist()}
+        with open(os.path.join(tmp, LABELS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(labels, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            shutil.rmtree(tmp)
+            if not os.path.isdir(directory):
+                raise
+            # Another process saved the same store first
+
+    @classmethod
+    def open(cls, directory):
+        """Maps a saved store read-only; nothing is read until it is used."""
+        with open(os.path.join(directory, LABELS_FILE), encoding='utf-8') as f:
+            labels = json.load(f)
+        arrays = {name: _map(os.path.join(directory, name + '.npy')) for name in MAPPED_ARRAYS}
+        store = cls(labels['pages'], arrays['codes'], arrays['offsets'],
+                    labels['sources'], arrays['source_codes'], labels['devices'], arrays['device_codes'])
+        # Fills the cached properties, so they are shared as well
+        for name in ['lengths', 'session_index', 'positions']:
+            store.__dict__[name] = arrays[name]
+        store.mapped = (directory, 0, len(store))
+        return store
+
+    def __reduce_ex__(self, protocol):
+        if self.mapped is not None:
+            return _open_mapped, self.mapped
+        return super().__reduce_ex__(protocol)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @cached_property
+    def lengths(self):
+        """Number of pages in each session."""
+        return np.diff(self.offsets)
+
+    @cached_property
+    def session_index(self):
+        """Session id of every entry in ``codes``."""
+        return np.repeat(np.arange(len(self), dtype=np.int32), self.lengths)
+
+    @cached_property
+    def positions(self):
+        """0-based position of every entry in ``codes`` within its session."""
+        return np.arange(len(self.codes), dtype=np.int64) - self.offsets[self.session_index]
+
+    @cached_property
+    def _page_lookup(self):
+        return {page: code for code, page in enumerate(self.pages)}
+
+    def page_code(self, page):
+        """Code of a page name, or -1 when the page never occurs."""
+        return self._page_lookup.get(page, -1)
+
+    def page_codes(self, pages):
+        return np.array([self.page_code(p) for p in _as_list(pages)], dtype=np.int32)
+
+    def decode(self, codes):
+        """Page names for an array of codes, with None where the code is -1."""
+        codes = np.asarray(codes)
+        names = np.empty(codes.shape, dtype=object)
+        valid = codes >= 0
+        names[valid] = self.pages[codes[valid]]
+        return names
+
+    def path(self, i):
+        return list(self.pages[self.codes[self.offsets[i]:self.offsets[i + 1]]])
+
+    def contains(self, pages):
+        """Whether each session visits the page (or any of a list of pages)."""
+        hits = np.isin(self.codes, self.page_codes(pages))
+        found = np.zeros(len(self), dtype=bool)
+        found[self.session_index[hits]] = True
+        return found
+
+    def path_length(self):
+        return self.lengths
+
+    def first_page(self):
+        """Code of each session's first page, -1 for empty sessions."""
+        first = np.full(len(self), -1, dtype=np.int32)
+        nonempty = self.lengths > 0
+        first[nonempty] = self.codes[self.offsets[:-1][nonempty]]
+        return first
+
+    def last_page(self):
+        """Code of each session's last page, -1 for empty sessions."""
+        last = np.full(len(self), -1, dtype=np.int32)
+        nonempty = self.lengths > 0
+        last[nonempty] = self.codes[self.offsets[1:][nonempty] - 1]
+        return last
+
+    def position(self, page):
+        """0-based position of the first visit to a page, -1 where it is absent."""
+        pos = np.full(len(self), -1, dtype=np.int64)
+        hits = np.flatnonzero(self.codes == self.page_code(page))
+        # Hits are in session order, so the first hit of a session is its first visit
+        sessions, first = np.unique(self.session_index[hits], return_index=True)
+        pos[sessions] = self.positions[hits[first]]
+        return pos
+
+    def padded(self, fill=-1):
+        """Page codes as an n x max-length matrix padded with ``fill``."""
+        width = int(self.lengths.max()) if len(self) else 0
+        matrix = np.full((len(self), width), fill, dtype=np.int32)
+        matrix[self.session_index, self.positions] = self.codes
+        return matrix
+
+    def source_mask(self, sources=None):
+        """Sessions whose Source is in ``sources`` (all sessions for None)."""
+        return self._label_mask(self.sources, self.source_codes, sources)
+
+    def device_mask(self, devices=None):
+        """Sessions whose Device is in ``devices`` (all sessions for None)."""
+        return self._label_mask(self.devices, self.device_codes, devices)
+
+    def _label_mask(self, labels, codes, selected):
+        selected = _as_list(selected)
+        if not selected:
+            return np.ones(len(self), dtype=bool)
+        wanted = np.flatnonzero(np.isin(labels, selected))
+        return np.isin(codes, wanted)
+
+    def slice(self, start, stop):
+        """Sessions ``start:stop`` as a store sharing this one's arrays."""
+        lo, hi = self.offsets[start], self.offsets[stop]
+        store = SessionStore(self.pages, self.codes[lo:hi], self.offsets[start:stop + 1] - lo,
+                             self.sources, self.source_codes[start:stop],
+                             self.devices, self.device_codes[start:stop])
+        if self.mapped is not None:
+            directory, base, _ = self.mapped
+            store.mapped = (directory, base + start, base + stop)
+        return store
+
+    def to_frame(self, rows):
+        """The given sessions as Source, Device and Link columns, like the export."""
+        rows = np.asarray(rows, dtype=np.int64)
+        subset = self.take(rows)
+        matrix = subset.padded()
+        links = np.full((len(rows), len(LINK_COLS)), None, dtype=object)
+        links[:, :matrix.shape[1]] = subset.decode(matrix)
+        frame = pd.DataFrame(links, columns=LINK_COLS, index=rows)
+        frame.insert(0, 'Device', _labels(self.devices, subset.device_codes))
+        frame.insert(0, 'Source', _labels(self.sources, subset.source_codes))
+        return frame
+
+    def take(self, rows):
+        """New store holding only the given sessions (boolean mask or indices)."""
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows)
+        lengths = self.lengths[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return SessionStore(self.pages, self.codes[gather], offsets,
+                            self.sources, self.source_codes[rows],
+                            self.devices, self.device_codes[rows])
+
+
+def _labels(labels, codes):
+    names = np.full(len(codes), None, dtype=object)
+    valid = codes >= 0
+    names[valid] = labels[codes[valid]]
+    return names
+
+
+def _map(path):
+    array = np.load(path, mmap_mode='r')
+    return array if array.size else np.load(path)  # empty files cannot be mapped
+
+
+def _open_mapped(directory, start, stop):
+    store = SessionStore.open(directory)
+    return store if (start, stop) == (0, len(store)) else store.slice(start, stop)
+
+
+def _load_mapped(path):
+    key = file_key(path)
+    directory = sidecar_path(key, "store")
+    if not os.path.isdir(directory):
+        store = SessionStore.from_frame(load_clickstream(path))
+        try:
+            os.makedirs(os.path.dirname(directory), exist_ok=True)
+            store.save(directory)
+            remove_stale(key, "store")
+        except OSError:
+            return store  # e.g. a read-only data folder: keep the store in memory
+    return SessionStore.open(directory)
+
+
+def load_sessions(path=DATA_PATH):
+    """Encoded sessions for the export at ``path``, mapped from a shared copy on disk."""
+    return cached(path, "sessions", lambda: _load_mapped(path))
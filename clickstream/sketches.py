@@ -0,0 +1,236 @@
+"""Fixed-memory sketches for path and page statistics.
+
+Exact path counters grow with the number of distinct paths. In approximate
+mode the aggregates keep these instead, each of a size fixed up front:
+
+- ``MisraGries``: the most frequent items (paths, drop-off pages), every
+  count at most ``error`` below the truth
+- ``CountMin``: per-item frequencies (page views), every estimate at most
+  ``error`` above the truth with probability ``confidence``
+- ``HyperLogLog``: the number of distinct items (paths), with a relative
+  standard error of ``relative_error``
+
+All of them merge across chunks, shards and files. Hashes are derived from
+the labels with a fixed key, so they agree between processes and runs.
+"""
+import heapq
+import math
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from clickstream.sessions import _as_list
+
+CAPACITY = 1000  # items kept by each Misra-Gries summary
+WIDTH = 2048  # Count-Min counters per row
+DEPTH = 4  # Count-Min rows
+PRECISION = 14  # HyperLogLog uses 2 ** PRECISION registers
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_labels(labels, seed=0):
+    """Deterministic 64-bit hashes of string labels."""
+    return pd.util.hash_array(np.asarray(labels, dtype=object), hash_key=f"clickstream{seed:05d}")
+
+
+def _mix(h):
+    # splitmix64 finalizer
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def path_hashes(store):
+    """One 64-bit hash per session path, independent of the store's page codes."""
+    page_hashes = hash_labels(store.pages)
+    matrix = store.padded()
+    hashes = np.zeros(len(store), dtype=np.uint64)
+    for column in matrix.T:
+        live = column >= 0
+        hashes[live] = _mix(hashes[live] * _GOLDEN + page_hashes[column[live]])
+    return hashes
+
+
+def _bit_length(values):
+    # float64 is exact on 32-bit halves, so log2 gives the exact bit length
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        return np.where(high > 0, 33 + np.floor(np.log2(high)),
+                        np.where(low > 0, 1 + np.floor(np.log2(low)), 0)).astype(np.int64)
+
+
+class MisraGries:
+    """Frequent-items summary of at most ``capacity`` items.
+
+    Counts underestimate by at most ``error``, itself at most
+    ``total / (capacity + 1)``; any item more frequent than ``error`` is kept.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+        self.total = 0
+
+    def _prune(self, counts):
+        if len(counts) > self.capacity:
+            cut = heapq.nlargest(self.capacity + 1, counts.values())[-1]
+            counts = {item: count - cut for item, count in counts.items() if count > cut}
+            self.error += cut
+        self.counts = dict(counts)
+
+    def update(self, counts):
+        """Adds a mapping of item -> count."""
+        merged = Counter(self.counts)
+        merged.update(counts)
+        self.total += sum(counts.values())
+        self._prune(merged)
+        return self
+
+    def merge(self, other):
+        if other.capacity != self.capacity:
+            raise ValueError("Cannot merge Misra-Gries summaries of different capacities")
+        merged = Counter(self.counts)
+        merged.update(other.counts)
+        self.total += other.total
+        self.error += other.error
+        self._prune(merged)
+        return self
+
+    def top(self, k=10):
+        """The ``k`` largest (item, count) pairs; ties break on the item."""
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+class CountMin:
+    """Count-Min sketch of ``depth`` x ``width`` counters.
+
+    Estimates never undercount and overcount by at most ``error`` with
+    probability ``confidence``.
+    """
+
+    def __init__(self, width=WIDTH, depth=DEPTH):
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, items):
+        first, second = hash_labels(items, 1), hash_labels(items, 2) | np.uint64(1)
+        width = np.uint64(self.table.shape[1])
+        return [((first + np.uint64(row) * second) % width).astype(np.int64) for row in range(len(self.table))]
+
+    def add(self, items, counts):
+        counts = np.asarray(counts, dtype=np.int64)
+        for row, columns in zip(self.table, self._columns(items)):
+            row += np.bincount(columns, weights=counts, minlength=len(row)).astype(np.int64)
+        self.total += int(counts.sum())
+        return self
+
+    def estimate(self, items):
+        """Estimated counts of ``items``, aligned with them."""
+        if not len(items):
+            return np.zeros(0, dtype=np.int64)
+        return np.min([row[columns] for row, columns in zip(self.table, self._columns(items))], axis=0)
+
+    def merge(self, other):
+        if other.table.shape != self.table.shape:
+            raise ValueError("Cannot merge Count-Min sketches of different shapes")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    @property
+    def error(self):
+        return math.e / self.table.shape[1] * self.total
+
+    @property
+    def confidence(self):
+        return 1 - math.exp(-len(self.table))
+
+
+class HyperLogLog:
+    """Distinct count estimate from ``2 ** precision`` one-byte registers."""
+
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        """Adds items by their 64-bit hashes (see ``hash_labels``, ``path_hashes``)."""
+        rest_bits = 64 - self.precision
+        index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rank = rest_bits + 1 - _bit_length(hashes & np.uint64((1 << rest_bits) - 1))
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # linear counting for small cardinalities
+        return float(raw)
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class Sketches:
+    """The approximate counterpart of the exact path counters in ``Aggregates``."""
+
+    def __init__(self, capacity=CAPACITY, width=WIDTH, depth=DEPTH, precision=PRECISION):
+        # (Source, path tuple) -> sessions
+        self.paths = MisraGries(capacity)
+        # (Source, Device, page) -> non-converting exits
+        self.dropoffs = MisraGries(capacity)
+        # page -> views
+        self.pages = CountMin(width, depth)
+        # distinct path tuples
+        self.distinct_paths = HyperLogLog(precision)
+
+    @classmethod
+    def from_store(cls, store, paths, dropoffs):
+        """Sketches of a store, given its exact path and drop-off counts."""
+        sketches = cls()
+        sketches.paths.update(paths)
+        sketches.dropoffs.update(dropoffs.to_dict())
+        sketches.pages.add(store.pages, np.bincount(store.codes, minlength=len(store.pages)))
+        sketches.distinct_paths.add_hashes(path_hashes(store))
+        return sketches
+
+    def merge(self, other):
+        self.paths.merge(other.paths)
+        self.dropoffs.merge(other.dropoffs)
+        self.pages.merge(other.pages)
+        self.distinct_paths.merge(other.distinct_paths)
+        return self
+
+    def top_paths(self, k=10, sources=None):
+        """Estimated most frequent paths; each count is at most ``path_error(sources)`` low."""
+        sources = _as_list(sources)
+        totals = Counter()
+        for (source, path), count in self.paths.counts.items():
+            if not sources or source in sources:
+                totals[path] += count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    def path_error(self, sources=None):
+        """Largest undercount of a ``top_paths`` count summed over ``sources`` (default: all of them)."""
+        sources = _as_list(sources)
+        if not sources:
+            sources = {source for source, _ in self.paths.counts}
+        return self.paths.error * len(sources)
+
+    def page_views(self, pages):
+        """Estimated views per page, at most ``pages.error`` high."""
+        pages = _as_list(pages)
+        return pd.Series(self.pages.estimate(pages), index=pages, dtype=np.int64)
@@ -0,0 +1,295 @@
+"""Chunked ingestion into mergeable aggregates.
+
+Exports that do not fit in memory are read with ``read_csv(chunksize=...)``.
+Each chunk is encoded, folded into an ``Aggregates`` and discarded, so peak
+memory follows the chunk size rather than the file size. Aggregates are
+plain label-keyed counters: two of them merge by addition, whichever files,
+chunks or shards they came from.
+
+The dashboards render from ``Aggregates`` in both modes; for files that fit
+in memory they are built from the cached ``SessionStore`` in one go. With
+``CLICKSTREAM_APPROXIMATE=1`` full paths are kept in fixed-size sketches
+(``clickstream.sketches``) instead of an exact counter.
+"""
+import copy
+import functools
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from clickstream.engine import COUNT_COLUMNS, _counts, kpi_table
+from clickstream.loader import DATA_PATH, cached, read_csv
+from clickstream.metrics import CONVERSION_PAGE
+from clickstream.parallel import imap_bounded, map_shards, shard_store
+from clickstream.profiling import profiled
+from clickstream.sessions import SessionStore, _as_list, load_sessions
+from clickstream.sketches import Sketches
+from clickstream.transitions import EXIT, START, TransitionMatrix, _pairs
+from clickstream.trie import PathTrie, load_trie
+
+CHUNK_SIZE = 250_000
+STREAMING_THRESHOLD = 256 * 1024 ** 2  # bytes; larger exports are streamed
+APPROXIMATE_ENV = "CLICKSTREAM_APPROXIMATE"  # set to 1 to sketch paths instead of counting them
+
+
+def _decode(labels, codes):
+    return np.asarray(labels, dtype=object)[codes]
+
+
+class Aggregates:
+    """Mergeable per (Source, Device) counters, exit pages, transitions and paths."""
+
+    # Also the values for aggregates pickled before these existed
+    sketches = None
+    lengths = None
+    trie = None
+
+    def __init__(self, counts=None, dropoffs=None, transitions=None, paths=None, sketches=None, lengths=None,
+                 trie=None):
+        # KPI counters per (Source, Device)
+        self.counts = counts if counts is not None else pd.DataFrame(
+            columns=COUNT_COLUMNS, index=pd.MultiIndex.from_tuples([], names=['Source', 'Device']), dtype=np.int64)
+        # Non-converting exits per (Source, Device, page)
+        self.dropoffs = dropoffs if dropoffs is not None else pd.Series(dtype=np.int64)
+        # Transition counts per (Source, Device, from, to), with start/exit states
+        self.transitions = transitions if transitions is not None else pd.Series(dtype=np.int64)
+        # Full path counts per (Source, path tuple); None when sketched
+        self.paths = paths if paths is not None or sketches is not None else Counter()
+        # Approximate path statistics, in approximate mode only
+        self.sketches = sketches
+        # Sessions per (Source, Device, path length)
+        self.lengths = lengths if lengths is not None else pd.Series(dtype=np.int64)
+        # The store's path trie, read instead of ``paths`` when those were not counted
+        self.trie = trie
+
+    @classmethod
+    @profiled
+    def from_store(cls, store, approximate=None, paths=True):
+        """Aggregates of every session in an encoded store.
+
+        ``approximate`` defaults to the ``CLICKSTREAM_APPROXIMATE`` setting.
+        ``paths=False`` leaves full paths uncounted and unsketched, for
+        callers that read them from the store's ``PathTrie``.
+        """
+        n_devices, n_pages = len(store.devices), len(store.pages)
+        cube = _counts(store)
+        index = pd.MultiIndex.from_product([store.sources, store.devices], names=['Source', 'Device'])
+        counts = pd.DataFrame(cube.reshape(-1, len(COUNT_COLUMNS)), index=index, columns=COUNT_COLUMNS).astype(np.int64)
+        counts = counts[counts['sessions'] > 0]
+
+        valid = (store.source_codes >= 0) & (store.device_codes >= 0)
+        source = store.source_codes.astype(np.int64)
+        device = store.device_codes.astype(np.int64)
+
+        last = store.last_page()
+        dropped = valid & (last >= 0) & (last != store.page_code(CONVERSION_PAGE))
+        keys, n = np.unique((source[dropped] * n_devices + device[dropped]) * n_pages + last[dropped], return_counts=True)
+        group, page = np.divmod(keys, n_pages)
+        dropoffs = pd.Series(n, index=pd.MultiIndex.from_arrays([
+            _decode(store.sources, group // n_devices), _decode(store.devices, group % n_devices),
+            _decode(store.pages, page)]))
+
+        width = int(store.lengths.max()) + 1 if len(store) else 1
+        keys, n = np.unique((source[valid] * n_devices + device[valid]) * width + store.lengths[valid], return_counts=True)
+        group, length = np.divmod(keys, width)
+        lengths = pd.Series(n, index=pd.MultiIndex.from_arrays([
+            _decode(store.sources, group // n_devices), _decode(store.devices, group % n_devices), length]))
+
+        n_states = n_pages + 2
+        states = list(store.pages) + [START, EXIT]
+        src, dst, sessions = _pairs(store)
+        keep = valid[sessions]
+        group = source[sessions[keep]] * n_devices + device[sessions[keep]]
+        keys, n = np.unique((group * n_states + src[keep]) * n_states + dst[keep], return_counts=True)
+        group, cell = np.divmod(keys, n_states * n_states)
+        transitions = pd.Series(n, index=pd.MultiIndex.from_arrays([
+            _decode(store.sources, group // n_devices), _decode(store.devices, group % n_devices),
+            _decode(states, cell // n_states), _decode(states, cell % n_states)]))
+        if not paths:
+            return cls(counts, dropoffs, transitions, lengths=lengths)
+
+        # Full paths are the trie's end nodes; its last count column is sessions without a Source
+        trie = PathTrie.from_store(store)
+        nodes, columns = np.nonzero(trie.ends[:, :-1])
+        paths = Counter(dict(zip(zip(_decode(store.sources, columns).tolist(), trie.paths(nodes)),
+                                 trie.ends[nodes, columns].tolist())))
+        if use_approximate() if approximate is None else approximate:
+            # The exact counts of one chunk are folded into the sketches and dropped
+            return cls(counts, dropoffs, transitions, None, Sketches.from_store(store, paths, dropoffs), lengths)
+        return cls(counts, dropoffs, transitions, paths, lengths=lengths)
+
+    def copy(self):
+        """An independent copy; merging into it leaves this one untouched."""
+        return Aggregates(self.counts, self.dropoffs, self.transitions,
+                          Counter(self.paths) if self.paths is not None else None,
+                          copy.deepcopy(self.sketches), self.lengths, self.trie)
+
+    def merge(self, other):
+        """Adds another set of aggregates into this one and returns it.
+
+        This mutates the aggregates; merge into a ``copy`` of any that other
+        threads may be reading.
+        """
+        if self.trie is not None or other.trie is not None:
+            raise ValueError("Cannot merge aggregates whose paths were left in a trie")
+        self.counts = self.counts.add(other.counts, fill_value=0).astype(np.int64)
+        self.dropoffs = self.dropoffs.add(other.dropoffs, fill_value=0).astype(np.int64)
+        self.transitions = self.transitions.add(other.transitions, fill_value=0).astype(np.int64)
+        if self.lengths is None or other.lengths is None:
+            self.lengths = None  # unknown once state from before length counts is involved
+        else:
+            self.lengths = self.lengths.add(other.lengths, fill_value=0).astype(np.int64)
+        if self.sketches is None and other.sketches is None:
+            self.paths.update(other.paths)
+            return self
+        if self.paths or other.paths:
+            raise ValueError("Cannot merge exact and approximate path counts")
+        self.paths = None
+        self.sketches = (Sketches() if self.sketches is None else self.sketches).merge(
+            Sketches() if other.sketches is None else other.sketches)
+        return self
+
+    @property
+    def sources(self):
+        return sorted(self.counts.index.unique(0))
+
+    @property
+    def devices(self):
+        return sorted(self.counts.index.unique(1))
+
+    @profiled
+    def kpis(self):
+        """The same tidy KPI table ``engine.compute_kpis`` builds from sessions."""
+        sources, devices = self.sources, self.devices
+        index = pd.MultiIndex.from_product([sources, devices])
+        cube = self.counts.reindex(index, fill_value=0).to_numpy()
+        return kpi_table(sources, devices, cube.reshape(len(sources), len(devices), len(COUNT_COLUMNS)))
+
+    def _select(self, series, selected_sources, selected_devices):
+        mask = np.ones(len(series), dtype=bool)
+        if _as_list(selected_sources):
+            mask &= series.index.get_level_values(0).isin(_as_list(selected_sources))
+        if _as_list(selected_devices):
+            mask &= series.index.get_level_values(1).isin(_as_list(selected_devices))
+        return series[mask]
+
+    @profiled
+    def dropoff_pages(self, selected_sources=None, selected_devices=None):
+        """Most common non-converting exit page per (source, device)."""
+        groups = self._select(self.counts['sessions'], selected_sources, selected_devices).index
+        dropoffs = self._select(self.dropoffs, selected_sources, selected_devices).sort_index()
+        dropoff_pages = {group: None for group in groups}
+        if not len(dropoffs):  # not yet a (Source, Device, page) index
+            return dropoff_pages
+        for (source, device), pages in dropoffs.groupby(level=[0, 1]):
+            # idxmax keeps the alphabetically first page on ties, like Series.mode
+            dropoff_pages[(source, device)] = pages.droplevel([0, 1]).idxmax()
+        return dropoff_pages
+
+    def length_histogram(self, selected_sources=None, selected_devices=None):
+        """Sessions per path length, or None for state from before length counts."""
+        if self.lengths is None:
+            return None
+        lengths = self._select(self.lengths, selected_sources, selected_devices)
+        return lengths.groupby(level=2).sum().sort_index().rename_axis('Path length')
+
+    @profiled
+    def transition_matrix(self, selected_sources=None, selected_devices=None):
+        """Transition counts of the selected sessions as a ``TransitionMatrix``."""
+        counts = self._select(self.transitions, selected_sources, selected_devices)
+        counts = counts.groupby(level=[2, 3]).sum()
+        pages = sorted((set(self.transitions.index.unique(2)) | set(self.transitions.index.unique(3))) - {START, EXIT})
+        states = pages + [START, EXIT]
+        lookup = {state: code for code, state in enumerate(states)}
+        src = np.array([lookup[s] for s in counts.index.get_level_values(0)], dtype=np.int64)
+        dst = np.array([lookup[s] for s in counts.index.get_level_values(1)], dtype=np.int64)
+        return TransitionMatrix(states, src, dst, counts.to_numpy())
+
+    @profiled
+    def top_paths(self, k=10, sources=None):
+        """The ``k`` most frequent full paths, optionally for some sources only.
+
+        In approximate mode the counts are estimates, see ``Sketches.top_paths``.
+        """
+        if self.sketches is not None:
+            return self.sketches.top_paths(k, sources)
+        sources = _as_list(sources)
+        if self.trie is not None:
+            # Only paths tied with the k-th count or above are decoded
+            ends = self.trie.ends[:, :-1]  # the last column is sessions without a Source
+            totals = ends[:, np.isin(self.trie.sources, sources)].sum(axis=1) if sources else ends.sum(axis=1)
+            nodes = np.flatnonzero(totals)
+            if k is not None and k < len(nodes):
+                nodes = nodes[totals[nodes] >= np.partition(totals[nodes], -k)[-k]]
+            totals = Counter(dict(zip(self.trie.paths(nodes), totals[nodes].tolist())))
+        else:
+            totals = Counter()
+            for (source, path), count in self.paths.items():
+                if not sources or source in sources:
+                    totals[path] += count
+        # Ties break on the path itself, so the order never depends on merge order
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def iter_chunks(path, chunksize=CHUNK_SIZE):
+    """Yields the export at ``path`` as encoded ``SessionStore`` chunks."""
+    with read_csv(path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield SessionStore.from_frame(chunk)
+
+
+@profiled
+def aggregate_store(store, workers=None, trie=None):
+    """``Aggregates.from_store`` sharded across worker processes for large stores.
+
+    Given the store's ``trie``, full paths are read from it rather than counted.
+    """
+    build = functools.partial(Aggregates.from_store, paths=trie is None)
+    shards = shard_store(store, workers)
+    if len(shards) == 1:
+        aggregates = build(store)
+    else:
+        aggregates = Aggregates()
+        for partial in map_shards(build, shards, workers):
+            aggregates.merge(partial)
+    aggregates.trie = trie
+    return aggregates
+
+
+@profiled
+def aggregate_file(path, chunksize=CHUNK_SIZE, workers=None):
+    """Folds an export into ``Aggregates`` one chunk at a time.
+
+    Chunks are aggregated in worker processes while the next ones are read;
+    pass ``workers=1`` to stay in the calling process.
+    """
+    aggregates = Aggregates()
+    for partial in imap_bounded(Aggregates.from_store, iter_chunks(path, chunksize), workers):
+        aggregates.merge(partial)
+    return aggregates
+
+
+def use_streaming(path=DATA_PATH):
+    """Whether an export is too large to load whole.
+
+    Set ``CLICKSTREAM_STREAMING`` to 1 or 0 to force the choice.
+    """
+    forced = os.environ.get("CLICKSTREAM_STREAMING")
+    if forced is not None:
+        return forced == "1"
+    return os.path.getsize(path) > STREAMING_THRESHOLD
+
+
+def use_approximate():
+    """Whether paths are sketched rather than counted exactly."""
+    return os.environ.get(APPROXIMATE_ENV) == "1"
+
+
+def load_aggregates(path=DATA_PATH):
+    """Dashboard aggregates for the export at ``path``, built once per file version."""
+    if use_streaming(path):
+        return cached(path, "aggregates", lambda: aggregate_file(path))
+    # The path views of in-memory exports use the cached trie, which top_paths shares
+    return cached(path, "aggregates", lambda: aggregate_store(load_sessions(path), trie=load_trie(path)))
@@ -0,0 +1,103 @@
+"""Synthetic clickstream exports for benchmarks and demos.
+
+Files are written in the exact headerless ``Source, Device, Link 1..Link 16``
+layout the pages read, in blocks of ``BLOCK_SIZE`` sessions, so 10M+ session
+files can be produced with bounded memory.
+
+    python -m clickstream.synthetic data/synthetic.csv --sessions 10000000
+"""
+import argparse
+
+import numpy as np
+
+SOURCES = {
+    'direct': 0.20,
+    'search': 0.25,
+    'facebook_advert': 0.12,
+    'linkedin_advert': 0.10,
+    'partner_advert': 0.08,
+    'facebook_share': 0.13,
+    'linkedin_share': 0.12,
+}
+DEVICES = {'desktop': 0.55, 'mobile': 0.38, 'tablet': 0.07}
+PAGES = [
+    'home', 'pricing', 'product', 'features', 'about', 'contact', 'careers', 'case_study',
+    'blog_1', 'blog_2', 'blog_3', 'blog_4', 'blog_5', 'blog_6', 'faq', 'docs',
+]
+MAX_LINKS = 16
+# Truncated geometric path lengths: many bounces, a long tail up to 16 pages
+LENGTH_DECAY = 0.72
+PURCHASE_START_RATE = 0.12  # sessions that reach purchase_start
+PURCHASE_SUCCESS_RATE = 0.45  # of those, sessions that complete the purchase
+BLOCK_SIZE = 500_000
+
+
+def length_distribution(decay=LENGTH_DECAY, max_links=MAX_LINKS):
+    """Probabilities of path lengths 1..max_links."""
+    weights = decay ** np.arange(max_links)
+    return weights / weights.sum()
+
+
+def _weights(mix):
+    labels = list(mix)
+    weights = np.array([mix[label] for label in labels], dtype=float)
+    return labels, weights / weights.sum()
+
+
+def generate_block(n, rng, sources=SOURCES, devices=DEVICES, pages=PAGES, lengths=None,
+                   purchase_start_rate=PURCHASE_START_RATE, purchase_success_rate=PURCHASE_SUCCESS_RATE):
+    """One block of sessions as (source, device, n x 16 page codes, lengths, vocabulary)."""
+    source_labels, source_p = _weights(sources)
+    device_labels, device_p = _weights(devices)
+    lengths_p = length_distribution() if lengths is None else np.asarray(lengths, dtype=float) / np.sum(lengths)
+
+    source = rng.choice(len(source_labels), size=n, p=source_p)
+    device = rng.choice(len(device_labels), size=n, p=device_p)
+    length = rng.choice(np.arange(1, len(lengths_p) + 1), size=n, p=lengths_p)
+
+    # Zipf-like page popularity: the first pages of the vocabulary get most views
+    popularity = 1.0 / np.arange(1, len(pages) + 1)
+    codes = rng.choice(len(pages), size=(n, MAX_LINKS), p=popularity / popularity.sum())
+
+    vocabulary = list(pages) + ['purchase_start', 'purchase_success']
+    start_code, success_code = len(pages), len(pages) + 1
+    starts = np.flatnonzero(rng.random(n) < purchase_start_rate)
+    length[starts] = np.maximum(length[starts], 2)
+    position = (rng.random(len(starts)) * (length[starts] - 1)).astype(np.int64)
+    codes[starts, position] = start_code
+    success = rng.random(len(starts)) < purchase_success_rate
+    # A completed purchase ends the session right after purchase_start
+    codes[starts[success], position[success] + 1] = success_code
+    length[starts[success]] = position[success] + 2
+    return np.array(source_labels, dtype=object)[source], np.array(device_labels, dtype=object)[device], codes, length, vocabulary
+
+
+def write_clickstream(path, n_sessions, seed=0, block_size=BLOCK_SIZE, **options):
+    """Writes ``n_sessions`` synthetic sessions to ``path``; options go to ``generate_block``."""
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for start in range(0, n_sessions, block_size):
+            n = min(block_size, n_sessions - start)
+            source, device, codes, length, vocabulary = generate_block(n, rng, **options)
+            names = np.array(vocabulary, dtype=object)[codes]
+            f.writelines(
+                ','.join([s, d, *row[:k]]) + '\n'
+                for s, d, row, k in zip(source, device, names.tolist(), length.tolist())
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic clickstream export.")
+    parser.add_argument('path')
+    parser.add_argument('--sessions', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--purchase-start-rate', type=float, default=PURCHASE_START_RATE)
+    parser.add_argument('--purchase-success-rate', type=float, default=PURCHASE_SUCCESS_RATE)
+    args = parser.parse_args(argv)
+    write_clickstream(args.path, args.sessions, seed=args.seed,
+                      purchase_start_rate=args.purchase_start_rate,
+                      purchase_success_rate=args.purchase_success_rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Page-to-page transition counts over encoded sessions.
+
+Every session contributes ``start -> first page``, one count per consecutive
+page pair and ``last page -> exit``. The counts are built in one vectorized
+pass and kept sparse (COO triplets sorted by source state), so "what comes
+before / after X" for any set of targets is a column or row lookup.
+"""
+from collections import Counter
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from clickstream.loader import DATA_PATH, cached
+from clickstream.profiling import profiled
+from clickstream.sessions import _as_list, load_sessions
+
+START = 'start'
+EXIT = 'exit'
+
+
+def _pairs(store):
+    """(from, to) state codes of every transition, with start/exit states appended."""
+    n_pages = len(store.pages)
+    start, exit_ = n_pages, n_pages + 1
+    same = store.session_index[1:] == store.session_index[:-1]
+    nonempty = store.lengths > 0
+    first = store.offsets[:-1][nonempty]
+    last = store.offsets[1:][nonempty] - 1
+    src = np.concatenate([store.codes[:-1][same], np.full(len(first), start), store.codes[last]])
+    dst = np.concatenate([store.codes[1:][same], store.codes[first], np.full(len(last), exit_)])
+    sessions = np.concatenate([store.session_index[:-1][same], np.flatnonzero(nonempty), np.flatnonzero(nonempty)])
+    return src.astype(np.int64), dst.astype(np.int64), sessions
+
+
+class TransitionMatrix:
+    """Sparse transition counts between pages plus synthetic start/exit states."""
+
+    def __init__(self, states, src, dst, counts):
+        self.states = np.asarray(states, dtype=object)
+        self.src = src
+        self.dst = dst
+        self.counts = counts
+
+    @classmethod
+    @profiled
+    def from_store(cls, store, mask=None):
+        """Transition counts of all sessions, or of the sessions selected by ``mask``."""
+        src, dst, sessions = _pairs(store)
+        if mask is not None:
+            keep = mask[sessions]
+            src, dst = src[keep], dst[keep]
+        return cls._from_pairs(store, src, dst)
+
+    @classmethod
+    def _from_pairs(cls, store, src, dst):
+        n_states = len(store.pages) + 2
+        keys, counts = np.unique(src * n_states + dst, return_counts=True)
+        return cls(list(store.pages) + [START, EXIT], keys // n_states, keys % n_states, counts)
+
+    def __len__(self):
+        return len(self.states)
+
+    @cached_property
+    def _lookup(self):
+        return {state: code for code, state in enumerate(self.states)}
+
+    def _codes(self, states):
+        return np.array([self._lookup[s] for s in _as_list(states) if s in self._lookup], dtype=np.int64)
+
+    def _series(self, codes, counts):
+        totals = np.bincount(codes, weights=counts, minlength=len(self)).astype(np.int64)
+        nonzero = np.flatnonzero(totals)
+        series = pd.Series(totals[nonzero], index=self.states[nonzero])
+        return series.sort_values(ascending=False, kind='stable')
+
+    def successors(self, states):
+        """Counts of the states that follow any of ``states`` (a row lookup)."""
+        rows = np.isin(self.src, self._codes(states))
+        return self._series(self.dst[rows], self.counts[rows])
+
+    def predecessors(self, states):
+        """Counts of the states that precede any of ``states`` (a column lookup)."""
+        cols = np.isin(self.dst, self._codes(states))
+        return self._series(self.src[cols], self.counts[cols])
+
+    def to_dense(self):
+        """Counts as a dense states x states array."""
+        dense = np.zeros((len(self), len(self)), dtype=np.int64)
+        dense[self.src, self.dst] = self.counts
+        return dense
+
+    def probabilities(self):
+        """Markov transition probabilities, normalized over each source state."""
+        totals = np.bincount(self.src, weights=self.counts, minlength=len(self))
+        return self.counts / totals[self.src]
+
+    def to_frame(self):
+        """Non-zero transitions with their counts and probabilities."""
+        return pd.DataFrame({
+            'from': self.states[self.src],
+            'to': self.states[self.dst],
+            'count': self.counts,
+            'probability': self.probabilities(),
+        })
+
+
+def transitions_by(store, by='Source'):
+    """One ``TransitionMatrix`` per Source or Device label, from a single pass."""
+    labels, codes = (store.sources, store.source_codes) if by == 'Source' else (store.devices, store.device_codes)
+    src, dst, sessions = _pairs(store)
+    group = codes[sessions].astype(np.int64)
+    valid = group >= 0
+    n_states = len(store.pages) + 2
+    keys, counts = np.unique((group[valid] * n_states + src[valid]) * n_states + dst[valid], return_counts=True)
+    cells = keys % (n_states * n_states)
+    bounds = np.searchsorted(keys // (n_states * n_states), np.arange(len(labels) + 1))
+    states = list(store.pages) + [START, EXIT]
+    matrices = {}
+    for g in range(len(labels)):
+        lo, hi = bounds[g], bounds[g + 1]
+        if hi > lo:
+            matrices[labels[g]] = TransitionMatrix(states, cells[lo:hi] // n_states, cells[lo:hi] % n_states, counts[lo:hi])
+    return matrices
+
+
+def load_transitions(path=DATA_PATH):
+    """Transition counts for the export at ``path``, built once per file version."""
+    return cached(path, "transitions", lambda: TransitionMatrix.from_store(load_sessions(path)))
+
+
+def pages_before_event(transitions, target_event='purchase_start'):
+    """Counts the pages visited just before ``target_event``; 'start' for entry visits."""
+    return Counter(transitions.predecessors(target_event).to_dict())
+
+
+def pages_after_event(transitions, target_event='purchase_start'):
+    """Counts the pages visited just after ``target_event``; 'exit' for the last visit."""
+    return Counter(transitions.successors(target_event).to_dict())
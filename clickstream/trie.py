@@ -0,0 +1,183 @@
+"""Prefix tree over encoded session paths.
+
+Nodes are numbered level by level and, within a level, in (parent, page)
+order, so the tree lives in a handful of flat arrays:
+
+* ``keys[i] = parent[i] * n_pages + page[i]`` is increasing, which makes a
+  child lookup a binary search;
+* the descendants of a node at each deeper level form one contiguous range
+  of node ids, which makes subtree queries slices rather than scans.
+
+Each node stores how many sessions pass through it (``prefix``) and how many
+end there (``ends``), split by Source. Shared prefixes are stored once, so
+memory follows the number of distinct prefixes, not the number of sessions.
+"""
+from functools import cached_property
+
+import numpy as np
+
+from clickstream.loader import DATA_PATH, cached
+from clickstream.profiling import profiled
+from clickstream.sessions import _as_list, load_sessions
+
+
+class PathTrie:
+    """Array-backed prefix tree with per-Source session counts at every node."""
+
+    def __init__(self, pages, sources, keys, depth, level_bounds, prefix, ends):
+        self.pages = np.asarray(pages, dtype=object)
+        self.sources = np.asarray(sources, dtype=object)
+        self.keys = keys
+        self.depth = depth
+        self.level_bounds = level_bounds
+        # Count tables have one column per Source plus one for sessions without a Source
+        self.prefix = prefix
+        self.ends = ends
+
+    @classmethod
+    @profiled
+    def from_store(cls, store):
+        """Builds the trie with one grouped pass per path position."""
+        n_pages, n_sources = len(store.pages), len(store.sources) + 1
+        source = np.where(store.source_codes >= 0, store.source_codes, n_sources - 1).astype(np.int64)
+        node = np.zeros(len(store), dtype=np.int64)
+        keys, depth, prefix = [np.array([-1])], [np.array([0])], [np.bincount(source, minlength=n_sources)[None, :]]
+        level_bounds = [0, 1]
+        for d in range(int(store.lengths.max()) if len(store) else 0):
+            sessions = np.flatnonzero(store.lengths > d)
+            key = node[sessions] * n_pages + store.codes[store.offsets[sessions] + d]
+            level_keys, inverse = np.unique(key, return_inverse=True)
+            ids = level_bounds[-1] + inverse.ravel()
+            node[sessions] = ids
+            keys.append(level_keys)
+            depth.append(np.full(len(level_keys), d + 1))
+            counts = np.bincount(inverse.ravel() * n_sources + source[sessions], minlength=len(level_keys) * n_sources)
+            prefix.append(counts.reshape(-1, n_sources))
+            level_bounds.append(level_bounds[-1] + len(level_keys))
+        n_nodes = level_bounds[-1]
+        ends = np.bincount(node * n_sources + source, minlength=n_nodes * n_sources).reshape(n_nodes, n_sources)
+        return cls(store.pages, store.sources,
+                   np.concatenate(keys), np.concatenate(depth).astype(np.int8), np.array(level_bounds),
+                   np.concatenate(prefix).astype(np.int32), ends.astype(np.int32))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @cached_property
+    def parent(self):
+        return np.where(self.keys >= 0, self.keys // len(self.pages), -1)
+
+    @cached_property
+    def page(self):
+        return np.where(self.keys >= 0, self.keys % len(self.pages), -1)
+
+    @cached_property
+    def _page_lookup(self):
+        return {page: code for code, page in enumerate(self.pages)}
+
+    def _columns(self, sources):
+        sources = _as_list(sources)
+        if not sources:
+            return slice(None)
+        return np.flatnonzero(np.isin(self.sources, sources))
+
+    def _count(self, table, nodes, sources):
+        return table[nodes][:, self._columns(sources)].sum(axis=1)
+
+    def find(self, prefix):
+        """Node id of a path prefix, or -1 when no session starts with it."""
+        node = 0
+        for page in prefix:
+            code = self._page_lookup.get(page)
+            if code is None:
+                return -1
+            key = node * len(self.pages) + code
+            i = np.searchsorted(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                return -1
+            node = int(i)
+        return node
+
+    def path(self, node):
+        """Page names from the root down to ``node``."""
+        pages = []
+        while node > 0:
+            pages.append(self.pages[self.page[node]])
+            node = self.parent[node]
+        return tuple(reversed(pages))
+
+    def paths(self, nodes):
+        """Page names from the root down to each of ``nodes``, decoded level by level."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        depth = self.depth[nodes].astype(np.int64)
+        width = int(depth.max()) if len(nodes) else 0
+        matrix = np.zeros((len(nodes), width), dtype=np.int64)
+        current = nodes.copy()
+        for d in range(width - 1, -1, -1):
+            # Nodes shallower than d + 1 are not moved until their own level comes up
+            deep = depth > d
+            matrix[deep, d] = self.page[current[deep]]
+            current[deep] = self.parent[current[deep]]
+        labels = self.pages[matrix]
+        return [tuple(row[:n]) for row, n in zip(labels.tolist(), depth.tolist())]
+
+    def _children_range(self, lo, hi):
+        """Ids of all children of the contiguous node range [lo, hi)."""
+        n_pages = len(self.pages)
+        return np.searchsorted(self.keys, lo * n_pages), np.searchsorted(self.keys, hi * n_pages)
+
+    def _subtree(self, node):
+        """Contiguous id ranges of ``node`` and its descendants, one per level."""
+        ranges = [(node, node + 1)]
+        while True:
+            lo, hi = self._children_range(*ranges[-1])
+            if lo == hi:
+                return ranges
+            ranges.append((int(lo), int(hi)))
+
+    def _top(self, nodes, counts, k):
+        if k is not None and k < len(counts):
+            keep = np.argpartition(-counts, k - 1)[:k]
+            nodes, counts = nodes[keep], counts[keep]
+        order = np.lexsort((nodes, -counts))[:k]
+        return [(self.path(int(nodes[i])), int(counts[i])) for i in order if counts[i] > 0]
+
+    def prefix_count(self, prefix, sources=None):
+        """Sessions whose path starts with ``prefix``."""
+        node = self.find(prefix)
+        return 0 if node < 0 else int(self._count(self.prefix, [node], sources)[0])
+
+    def prefix_counts(self, depth, sources=None, k=None):
+        """Every prefix of ``depth`` pages with its session count, most frequent first."""
+        if depth + 1 >= len(self.level_bounds):
+            return []
+        nodes = np.arange(self.level_bounds[depth], self.level_bounds[depth + 1])
+        return self._top(nodes, self._count(self.prefix, nodes, sources), k)
+
+    def top_paths(self, k=10, sources=None):
+        """The ``k`` most frequent full paths."""
+        nodes = np.arange(len(self))
+        return self._top(nodes, self._count(self.ends, nodes, sources), k)
+
+    def next_pages(self, prefix, sources=None):
+        """Counts of the page that directly follows ``prefix``."""
+        node = self.find(prefix)
+        if node < 0:
+            return []
+        lo, hi = self._children_range(node, node + 1)
+        nodes = np.arange(lo, hi)
+        counts = self._count(self.prefix, nodes, sources)
+        return [(self.pages[self.page[n]], int(c)) for n, c in zip(nodes, counts) if c > 0]
+
+    def continuations(self, prefix, k=10, sources=None):
+        """The ``k`` most frequent full paths that start with ``prefix``."""
+        node = self.find(prefix)
+        if node < 0:
+            return []
+        nodes = np.concatenate([np.arange(lo, hi) for lo, hi in self._subtree(node)])
+        return self._top(nodes, self._count(self.ends, nodes, sources), k)
+
+
+def load_trie(path=DATA_PATH):
+    """Path trie for the export at ``path``, built once per file version."""
+    return cached(path, "trie", lambda: PathTrie.from_store(load_sessions(path)))
@@ -1,257 +1,198 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-from collections import Counter
+
+from clickstream.loader import load_clickstream
+from clickstream.sessions import load_sessions
+from clickstream.trie import load_trie
+from clickstream.engine import ALL, kpi_row
+from clickstream.funnels import funnel_engine, step_conversion
+from clickstream.comparison import METRICS, load_bootstrap
+from clickstream.bitmaps import load_bitmaps
+from clickstream.patterns import MAX_LENGTH, MIN_SUPPORT, load_patterns
+from clickstream.streaming import load_aggregates, use_streaming
+from clickstream.incremental import refresh, use_incremental
+from clickstream.profiling import Profiler, render_sidebar, step
+from clickstream.report import CAMPAIGN_SOURCES
 
 st.set_page_config(page_title="Visitor Clickstream Analysis", page_icon="📊", layout="wide", initial_sidebar_state="collapsed")
 
 st.title("Visitor Clickstream Analysis -- W&SNA")
 st.caption("Atashi Sharma -- S2669393")
 
-
-if 'df' not in st.session_state:  # Check if 'df' is already in session_state
-    try:
-        path = "data/clickstream_data.csv"
-        headers = ["Source", "Device", "Link 1", "Link 2", "Link 3", "Link 4", "Link 5", "Link 6", "Link 7", "Link 8", "Link 9", "Link 10", "Link 11", "Link 12", "Link 13", "Link 14", "Link 15", "Link 16"]
-        df = pd.read_csv(path, on_bad_lines='skip', names=headers, encoding='utf-8')
-
-        link_cols = [f"Link {i}" for i in range(1, 17)]
-        df['path'] = df[link_cols].apply(lambda row: [link for link in row.dropna().tolist()], axis=1)
-        df.drop(link_cols, axis=1, inplace=True) # Drop link columns
-        
-        st.session_state.df = df  # Store the processed DataFrame in session_state
-        st.success("Database loaded and processed successfully (one time).")
-
-    except Exception as e:
-        st.error(f"❌ Error loading/processing data: {e}")
-        st.stop()
-
-else:
-    df = st.session_state.df  # Retrieve the DataFrame from session_state
-
-if st.toggle("Dataframe Summary"):
-    st.write(df.describe())
-
-
-
-if st.toggle("Show Frequent User Paths"):
-    st.write("FrequentU ser Paths:")
-    path_counts = Counter(tuple(path) for path in df['path'])  
-    most_common_paths = path_counts.most_common(10)  # Get top 10 most frequent paths (adjust number as needed)
-    st.write("Most Frequent User Paths:")
-    for path, count in most_common_paths:
-        st.write(f"{' -> '.join(path)} (Count: {count})")
+profiler = st.session_state.setdefault('profiler', Profiler())  # Kept across reruns for the latency history
+profiler.start_run("main")
+
+
+incremental = use_incremental()  # Hourly drops in data/incoming are merged into a persisted state
+streaming = incremental or use_streaming()  # Exports too large for memory are folded chunk by chunk
+
+try:
+    # Nothing is copied into session_state: every browser session and worker
+    # process reads the same memory-mapped session arrays
+    with step("path construction"):
+        sessions = None if streaming else load_sessions()
+except Exception as e:
+    st.error(f"❌ Error loading/processing data: {e}")
+    st.stop()
+
+if 'loaded' not in st.session_state:
+    st.session_state.loaded = True
+    st.success("Database loaded and processed successfully (one time).")
+
+try:
+    # Everything the dashboards below render from; only new drops are read on a rerun
+    with step("aggregates"):
+        aggregates = refresh() if incremental else load_aggregates()
+except Exception as e:
+    st.error(f"❌ Error loading/processing data: {e}")
+    st.stop()
+
+if not streaming and st.toggle("Dataframe Summary"):
+    with step("data load"):
+        st.write(load_clickstream().describe())  # The frame is only loaded for the summary
+
+
+
+with step("frequent user paths"):
+    if st.toggle("Show Frequent User Paths"):
+        path_sources = st.multiselect("Sources", aggregates.sources)
+        prefix = [] if streaming else st.multiselect("Starting with pages (in order)", list(sessions.pages))
+        if streaming:
+            top_paths = aggregates.top_paths(10, path_sources)
+            if aggregates.sketches is not None:  # CLICKSTREAM_APPROXIMATE=1 keeps paths in fixed-size sketches
+                sketches = aggregates.sketches
+                st.caption(f"Approximate counts, each at most {sketches.path_error(path_sources or aggregates.sources):,} low; "
+                           f"about {sketches.distinct_paths.estimate():,.0f} distinct paths "
+                           f"(±{sketches.distinct_paths.relative_error:.1%}).")
+        elif prefix:
+            trie = load_trie()  # Built once per file version, queries never rescan sessions
+            st.write(f"Sessions starting with {' -> '.join(prefix)}: {trie.prefix_count(prefix, path_sources)}")
+            top_paths = trie.continuations(prefix, 10, path_sources)
+        else:
+            top_paths = load_trie().top_paths(10, path_sources)  # Get top 10 most frequent paths (adjust number as needed)
+        st.write("Most Frequent User Paths:")
+        for path, count in top_paths:
+            st.write(f"{' -> '.join(path)} (Count: {count})")
+        if not streaming and st.toggle("Frequent page sequences (other pages allowed in between)"):
+            col1, col2 = st.columns(2)
+            with col1:
+                min_support = st.number_input("Minimum share of sessions", 0.001, 1.0, MIN_SUPPORT, step=0.005, format="%.3f")
+            with col2:
+                max_length = st.slider("Longest sequence", 2, 6, MAX_LENGTH)
+            # Mined once per file version and settings, first pages in parallel
+            patterns = load_patterns(min_support=min_support, max_length=max_length, sources=path_sources, min_length=2)
+            for pattern, count in patterns[:10]:
+                st.write(f"{' … '.join(pattern)} (Sessions: {count})")
 st.write("---")
 
-## Functions
-def bounce_rate_by_source(df):
-  bounce_rates = {}
-  for source, group in df.groupby('Source'):
-    single_page_visits = group['Link 2'].isnull().sum()
-    bounce_rate = (single_page_visits / len(group)) * 100
-    bounce_rates[source] = bounce_rate
-  return bounce_rate
-
-def bounce_rate_by_source_device(df, selected_sources=None, selected_devices=None):
-    """Calculates bounce rate by source and device, with filtering options."""
-    filtered_df = df.copy()
-
-    if selected_sources:
-        filtered_df = filtered_df[filtered_df['Source'].isin(selected_sources)]
-    if selected_devices:
-        filtered_df = filtered_df[filtered_df['Device'].isin(selected_devices)]
+with step("campaign performance"):
+    # Every KPI for every (Source, Device, all) combination, from the aggregates
+    kpis = aggregates.kpis()
 
-    bounce_rates = {}
-    for (source, device), group in filtered_df.groupby(['Source', 'Device']):
-        single_page_visits = group['path'].apply(lambda x: len(x) == 1).sum()
-        bounce_rate = (single_page_visits / len(group)) * 100
-        bounce_rates[(source, device)] = bounce_rate
+    st.header("Campaign Performance Analytics")
+    campaign_sources = CAMPAIGN_SOURCES  # Shared with the batch reports
 
-    # Calculate overall bounce rate for each source:
-    for source in filtered_df['Source'].unique():
-        all_devices_group = filtered_df[filtered_df['Source'] == source]
-        single_page_visits_all = all_devices_group['path'].apply(lambda x: len(x) == 1).sum()
-        bounce_rate_all = (single_page_visits_all / len(all_devices_group)) * 100
-        bounce_rates[(source, 'all')] = bounce_rate_all
+    for source in campaign_sources:
+        st.header(f"Campaign: {source}")
+        source_kpis = kpi_row(kpis, source, ALL)
 
-    return bounce_rates
+        # 1. Bounce Rate
+        st.write(f"Bounce Rate: {source_kpis['bounce_rate']:.2f}%")
 
-def pages_before_event(df, target_event='purchase_start'):
-    pages_before = Counter()
-    for _, row in df.iterrows():
-        for i in range(1, 17):  # Check from Link 1 to Link 16
-            if row[f'Link {i}'] == target_event:
-                try:
-                    next_page = row[f'Link {i-1}']
-                    pages_before[next_page] += 1
-                except:
-                    next_page = "start"
-                    pages_before[next_page] += 1
-                break  # Move to the next row once the target event is found
-    return pages_before
+        # 2. Conversion Rate (Purchase Success Rate)
+        st.write(f"Conversion Rate: {source_kpis['conversion_rate']:.2f}%")
 
-def pages_after_event(df, target_event='purchase_start'):
-    pages_after = Counter()
-    for _, row in df.iterrows():
-        for i in range(1, 17):  # Check from Link 1 to Link 16
-            if row[f'Link {i}'] == target_event:
-                next_page = row[f'Link {i+1}']
-                pages_after[next_page] += 1
-                break  # Move to the next row once the target event is found
-    return pages_after
+        # 3. Average Links to Purchase Success
+        st.write(f"Average Links to Purchase Success: {source_kpis['avg_links_to_purchase']:.2f}")
 
-def avg_links_to_purchase(df, selected_source=None):
-    if selected_source:
-        filtered_df = df[df['Source'] == selected_source]
-    else:
-        filtered_df = df
-    successful_paths = filtered_df[filtered_df['path'].apply(lambda p: 'purchase_success' in p)]
-    if not successful_paths.empty:
-        avg_links = successful_paths['path'].apply(len).mean()
-        return avg_links
-    else:
-        return 0
-
-def calculate_purchase_success_rate(df, selected_source=None):
-    if selected_source:
-        filtered_df = df[df['Source'] == selected_source]
-    else:
-        filtered_df = df
-    if not filtered_df.empty:
-        purchase_success_rate = (filtered_df['path'].apply(lambda p: 'purchase_success' in p).sum() / len(filtered_df)) * 100
-        return purchase_success_rate
-    else:
-        return 0
+        # 4. Purchase Success Rate by Device
+        st.write("Purchase Success Rate by Device:")
+        if source in kpis.index.get_level_values('Source'):
+            for device, rate in kpis.loc[source, 'conversion_rate'].drop(ALL).items():
+                st.write(f"- {device}: {rate:.2f}%")
 
-def avg_links_visited_by_source(df, selected_sources=None):
-    if selected_sources:
-        filtered_df = df[df['Source'] == selected_sources]
-    else:
-        filtered_df = df
-    if not filtered_df.empty:
-        filtered_df['links_visited'] = filtered_df[link_cols].notna().sum(axis=1)  # Count non-null links
-        avg_links = filtered_df['links_visited'].mean()
-        return avg_links
-    else:
-        return 0
+        # 5. Drop-off Page Ranking
+        dropoff_pages = aggregates.dropoff_pages(selected_sources=[source])
+        st.write("Drop-off Page Ranking:")
+        sorted_dropoffs = sorted(dropoff_pages.items(), key=lambda item: item, reverse=True) # Sort by drop-off count
+        for (source, device), dropoff_page in sorted_dropoffs:
+            st.write(f"Source: {source}, Device: {device}, Page: {dropoff_page}")
 
-def conversion_rate_by_device(df, selected_sources=None):
-    if selected_sources:
-        filtered_df = df[df['Source'] == selected_sources]
-    else:
-        filtered_df = df
-    if not filtered_df.empty:
-        conversion_rates = filtered_df.groupby('Device')['path'].apply(lambda x: (x.apply(lambda p: 'purchase_success' in p).sum() / len(x)) * 100).to_dict()
-        return conversion_rates
-    else:
-        return {}
+st.write("---")
+st.header("Platform Behavior Analytics")
 
-def conversion_rate_by_page(df, selected_sources=None, pages=None):
-    if selected_sources:
-        filtered_df = df[df['Source'].isin(selected_sources)]
-    else:
-        filtered_df = df
-    if pages:
-        filtered_df['last_page'] = filtered_df['path'].apply(lambda x: x[-1] if x else None)
-        filtered_df = filtered_df[filtered_df['last_page'].isin(pages)]
-    if not filtered_df.empty:
-        conversion_rates = (filtered_df['path'].apply(lambda p: 'purchase_success' in p).sum() / len(filtered_df)) * 100
-        return conversion_rates
+with step("platform behavior"):
+    if streaming:
+        st.info("Funnels need the in-memory session store, which is not built for streamed exports.")
     else:
-        return 0
+        pages = list(sessions.pages)
+        funnel_steps = st.multiselect("Funnel steps (in order)", pages,
+                                      default=[p for p in ['purchase_start', 'purchase_success'] if p in pages])
+        strict = not st.toggle("Allow other pages between steps", value=True)
+        if funnel_steps:
+            funnel = funnel_engine(sessions).table(funnel_steps, strict)  # Earlier steps are reused across reruns
+            st.write("Sessions reaching each step, by device:")
+            st.dataframe(funnel.xs(ALL, level='Source'))
+            if len(funnel_steps) > 1:
+                st.write("Step-to-step conversion (%), by device:")
+                st.dataframe(step_conversion(funnel).xs(ALL, level='Source').round(2))
+            if st.toggle("Break down by Source and Device"):
+                st.dataframe(funnel)
 
-def conversion_rate_by_first_page(df, selected_sources=None, pages=None):
-    filtered_df = df.copy()
-    if selected_sources:
-        filtered_df = filtered_df[filtered_df['Source'].isin(selected_sources)]
-
-    if pages:
-        filtered_df['first_page'] = filtered_df['path'].apply(lambda x: x if x else None)  # Get the FIRST page
-        filtered_df = filtered_df[filtered_df['first_page'].isin(pages)]
+st.write("---")
+st.header("Source Comparison Analytics")
 
-    if not filtered_df.empty:
-        conversion_rates = (filtered_df['path'].apply(lambda p: 'purchase_success' in p).sum() / len(filtered_df)) * 100
-        return conversion_rates
+with step("source comparison"):
+    if streaming:
+        st.info("Confidence intervals need the in-memory session store, which is not built for streamed exports.")
     else:
-        return 0
-
-def bounce_rate_by_source_device(df, selected_sources=None, selected_devices=None):
-    """Calculates bounce rate by source and device, with filtering options."""
-    filtered_df = df.copy()  # Create a copy to avoid modifying the original DataFrame
-
-    if selected_sources:
-        filtered_df = filtered_df[filtered_df['Source'].isin(selected_sources)]
-    if selected_devices:
-        filtered_df = filtered_df[filtered_df['Device'].isin(selected_devices)]
-
-    bounce_rates = {}
-    for (source, device), group in filtered_df.groupby(['Source', 'Device']):
-        single_page_visits = group['path'].apply(lambda x: len(x) == 1).sum()
-        bounce_rate = (single_page_visits / len(group)) * 100
-        bounce_rates[(source, device)] = bounce_rate
-    return bounce_rates
-
-def dropoff_page_by_source_device(df, selected_sources=None, selected_devices=None):
-    """Calculates drop-off page by source and device, with filtering."""
-    filtered_df = df.copy()
-
-    if selected_sources:
-        filtered_df = filtered_df[filtered_df['Source'].isin(selected_sources)]
-    if selected_devices:
-        filtered_df = filtered_df[filtered_df['Device'].isin(selected_devices)]
-
-    dropoff_pages = {}
-    for (source, device), group in filtered_df.groupby(['Source', 'Device']):
-        last_pages = group['path'].apply(lambda x: x[-1] if x and x[-1]!= 'purchase_success' else None).dropna()
-        if not last_pages.empty:
-            most_common_dropoff = last_pages.mode()
-            dropoff_pages[(source, device)] = most_common_dropoff
+        bootstrap = load_bootstrap()  # Every group resampled in one batched draw, once per file version
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            metric = st.selectbox("Metric", METRICS, format_func=lambda m: m.replace('_', ' ').capitalize())
+        with col2:
+            device = st.selectbox("Device", [ALL] + list(sessions.devices))
+        with col3:
+            confidence = st.select_slider("Confidence", [0.8, 0.9, 0.95, 0.99], value=0.95)
+        intervals = bootstrap.intervals(metric, confidence).xs(device, level='Device').drop(ALL, errors='ignore')
+        st.write(f"{confidence:.0%} confidence intervals ({bootstrap.resamples:,} bootstrap resamples):")
+        st.dataframe(intervals.round(2))
+        if len(intervals) < 2:
+            st.info("Pairwise differences need at least two sources with sessions on this device.")
         else:
-            dropoff_pages[(source, device)] = None
-    return dropoff_pages
-
-
-# Example usage:
-# Assuming you have your DataFrame 'df' with 'Source', 'Device', and 'path' columns
-
-st.header("Campaign Performance Analytics")
-campaign_sources = ['facebook_advert', 'linkedin_advert', 'partner_advert']
-
-for source in campaign_sources:
-    st.header(f"Campaign: {source}")
-
-    # 1. Bounce Rate
-    bounce_rate = bounce_rate_by_source_device(df, selected_sources=[source])
-    st.write(f"Bounce Rate: {bounce_rate[(source, 'all')]:.2f}%")  # Assuming 'all' for all devices
-
-    # 2. Conversion Rate (Purchase Success Rate)
-    conversion_rate = calculate_purchase_success_rate(df, selected_source=source)
-    st.write(f"Conversion Rate: {conversion_rate:.2f}%")
-
-    # 3. Average Links to Purchase Success
-    avg_links = avg_links_to_purchase(df, selected_source=source)
-    st.write(f"Average Links to Purchase Success: {avg_links:.2f}")
-
-    # 4. Purchase Success Rate by Device
-    success_by_device = conversion_rate_by_device(df, selected_sources=[source])
-    st.write("Purchase Success Rate by Device:")
-    for device, rate in success_by_device.items():
-        st.write(f"- {device}: {rate:.2f}%")
-
-    # 5. Drop-off Page Ranking
-    dropoff_pages = dropoff_page_by_source_device(df, selected_sources=[source])
-    st.write("Drop-off Page Ranking:")
-    sorted_dropoffs = sorted(dropoff_pages.items(), key=lambda item: item, reverse=True) # Sort by drop-off count
-    for (source, device), dropoff_count in sorted_dropoffs:
-        st.write(f"Source: {source}, Device: {device}, Count: {dropoff_count}")
+            pairs = bootstrap.compare(metric, [(source, device) for source in intervals.index], confidence)
+            pairs['a'], pairs['b'] = pairs['a'].str[0], pairs['b'].str[0]
+            if st.toggle("Only significant differences", value=True):
+                pairs = pairs[pairs['significant']]
+            st.write("Pairwise differences (a - b):")
+            st.dataframe(pairs.round(3), hide_index=True)
 
 st.write("---")
-st.header("Platform Behavior Analytics")
+st.header("Blog Performance Analytics")
 
-st.write("---")
-st.header("Source Comparison Analytics")
+with step("blog performance"):
+    if streaming:
+        st.info("Page segments need the in-memory session store, which is not built for streamed exports.")
+    else:
+        bitmaps = load_bitmaps()  # One session bitmap per page, exit page, Source and Device
+        blog_pages = [page for page in sessions.pages if page.startswith('blog')]
+        col1, col2 = st.columns(2)
+        with col1:
+            blog_sources = st.multiselect("Sources", list(sessions.sources), key="blog_sources")
+        with col2:
+            blog_devices = st.multiselect("Devices", list(sessions.devices), key="blog_devices")
+        st.write("Sessions visiting each blog page:")
+        st.dataframe(bitmaps.page_table(blog_pages, blog_sources, blog_devices).round(2))
+
+        visited = st.multiselect("Sessions that visited all of", list(sessions.pages), default=blog_pages[:1])
+        selected = bitmaps.select(visited, blog_sources, blog_devices)
+        total = bitmaps.count(selected)
+        converted = bitmaps.conversions(selected)
+        st.write(f"{total:,} sessions, {converted:,} converted ({converted / total * 100 if total else 0:.2f}%)")
+        st.write("Where they exited:")
+        st.dataframe(bitmaps.breakdown(selected, 'exit').sort_values(ascending=False).head(10))
 
 st.write("---")
-st.header("Blog Performance Analytics")
 
-st.write("---")
\ No newline at end of file
+profiler.end_run()
+if st.sidebar.toggle("Show performance panel"):
+    render_sidebar(profiler)
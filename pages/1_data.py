@@ -1,14 +1,41 @@
+import math
+
 import streamlit as st
-import pandas as pd
-import numpy as np
+
+from clickstream.browser import load_row_index
+from clickstream.incremental import use_incremental
+from clickstream.sessions import load_sessions
+from clickstream.streaming import use_streaming
 
 
 st.title("Visitor Clickstream Analysis")
 
-path = "data/clickstream_data.csv"
+if use_incremental() or use_streaming():
+    # The browser needs every session in memory, which these modes exist to avoid
+    st.info("The data browser is not available for streamed or incremental data; "
+            "the dashboards on the other pages are built chunk by chunk instead.")
+    st.stop()
+
+sessions = load_sessions()  # Memory-mapped, shared with every session and process
+index = load_row_index()  # Posting lists per Source, Device, path length and page
+
+col1, col2 = st.columns(2)
+with col1:
+    sources = st.multiselect("Source", index.labels['source'])
+    devices = st.multiselect("Device", index.labels['device'])
+with col2:
+    pages = st.multiselect("Visits any of these pages", index.labels['page'])
+    max_length = index.labels['length'][-1]
+    min_links, max_links = st.slider("Path length", 0, max(max_length, 1), (0, max_length))
+lengths = None if (min_links, max_links) == (0, max_length) else list(range(min_links, max_links + 1))
 
-headers=["Source", "Device", "Link 1", "Link 2", "Link 3" , "Link 4", "Link 5", "Link 6", "Link 7", "Link 8", "Link 9", "Link 10", "Link 11", "Link 12", "Link 13", "Link 14", "Link 15", "Link 16"]
-df = pd.read_csv(path, on_bad_lines='skip', names=headers,  encoding='utf-8')
+# Filtering runs on the server against the index; only one page of rows is sent
+selected = index.select(sources, devices, lengths, pages)
+total = index.count(selected)
 
+page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+n_pages = max(1, math.ceil(total / page_size))
+page = st.number_input("Page", min_value=1, max_value=n_pages, value=1)
+st.caption(f"{total:,} matching sessions, page {page} of {n_pages:,}")
 
-st.dataframe(df)
\ No newline at end of file
+st.dataframe(sessions.to_frame(index.page(selected, page, page_size)))
@@ -1,47 +1,80 @@
-import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
 
-def load_data(file_path, headers=None):
+from clickstream.incremental import refresh, use_incremental
+from clickstream.plots import bar_png, conversion_grid, heatmap_png, sankey_figure, sankey_links, session_counts
+from clickstream.streaming import load_aggregates
+
+
+# Charts are cached on the content of their count tables, so they are redrawn
+# only when the data (or the selection) changes
+@st.cache_data(max_entries=64)
+def cached_bar(counts, title, xlabel):
+    return bar_png(counts, title, xlabel)
+
+
+@st.cache_data(max_entries=64)
+def cached_heatmap(grid, title):
+    return heatmap_png(grid, title)
+
+
+@st.cache_data(max_entries=16)
+def cached_sankey(links):
+    return sankey_figure(links)
+
+
+def load_data():
     """
-    Loads a CSV file, handles errors gracefully, and ensures required columns exist.
+    Loads the shared aggregates, handles errors gracefully.
     """
     try:
-        df = pd.read_csv(file_path, on_bad_lines='skip', names=headers, encoding='utf-8')
+        aggregates = refresh() if use_incremental() else load_aggregates()
         st.write("✅ Data loaded successfully!")
     except Exception as e:
         st.error(f"❌ Error loading data: {e}")
         return None
+    return aggregates
 
-    # Ensure necessary columns exist
-    required_columns = ["Source", "Device"]
-    for col in required_columns:
-        if col not in df.columns:
-            st.warning(f"⚠️ Missing expected column: {col}")
-            df[col] = "Unknown"  # Fill missing columns with default values
-
-    return df
-
-def plot_value_counts(df, column, title):
+def plot_counts(counts, title, xlabel):
     """
-    Plots value counts for a given column, handling empty or missing data.
+    Plots a count table, handling empty data.
     """
-    if column in df.columns and not df[column].isna().all():
-        fig, ax = plt.subplots()
-        df[column].value_counts().plot(kind='bar', ax=ax)
-        ax.set_title(title)
-        ax.set_xlabel(column)
-        ax.set_ylabel("Count")
-        st.pyplot(fig)
+    if counts is not None and counts.sum() > 0:
+        st.image(cached_bar(counts, title, xlabel))
     else:
-        st.warning(f"⚠️ No valid data to plot for column: {column}")
+        st.warning(f"⚠️ No valid data to plot for: {xlabel}")
 
 # Load data
-path = "data/clickstream_data.csv"  # Update with your file path
-headers=["Source", "Device", "Link 1", "Link 2", "Link 3" , "Link 4", "Link 5", "Link 6", "Link 7", "Link 8", "Link 9", "Link 10", "Link 11", "Link 12", "Link 13", "Link 14", "Link 15", "Link 16"]
-df = load_data(path, headers)
+aggregates = load_data()
 
 # Plot graphs if data is valid
-if df is not None:
-    plot_value_counts(df, "Source", "Source Distribution")
-    plot_value_counts(df, "Device", "Device Distribution")
+if aggregates is not None:
+    plot_counts(session_counts(aggregates, 'Source'), "Source Distribution", "Source")
+    plot_counts(session_counts(aggregates, 'Device'), "Device Distribution", "Device")
+
+    st.header("Path Lengths")
+    col1, col2 = st.columns(2)
+    with col1:
+        length_sources = st.multiselect("Sources", aggregates.sources)
+    with col2:
+        length_devices = st.multiselect("Devices", aggregates.devices)
+    lengths = aggregates.length_histogram(length_sources, length_devices)
+    if lengths is None:
+        st.info("Path lengths are not in the saved state yet; clear data/.state to re-ingest.")
+    else:
+        plot_counts(lengths, "Path Length Distribution", "Path length")
+
+    st.header("Conversion by Source and Device")
+    grid = conversion_grid(aggregates.kpis(), include_all=st.toggle("Include 'all' totals", value=True))
+    if grid.empty:
+        st.warning("⚠️ No valid data to plot for: conversion")
+    else:
+        st.image(cached_heatmap(grid, "Conversion Rate (%)"))
+
+    st.header("Page Transitions")
+    top = st.slider("Transitions shown", 5, 100, 30)
+    links = sankey_links(aggregates.transition_matrix(), top, st.toggle("Include entry and exit"))
+    try:
+        st.plotly_chart(cached_sankey(links))
+    except ImportError:
+        st.info("Install plotly for the Sankey diagram; showing the transitions as a table.")
+        st.dataframe(links)
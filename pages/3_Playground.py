@@ -1,151 +1,67 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-from collections import Counter
+from concurrent.futures import as_completed
 
+from clickstream.loader import DATA_PATH, file_key, load_clickstream
+from clickstream.engine import ALL, kpi_row
+from clickstream.streaming import load_aggregates, use_streaming
+from clickstream.incremental import incoming_version, refresh, use_incremental
+from clickstream.transitions import EXIT, START
+from clickstream.profiling import Profiler, render_sidebar, step
+from clickstream.scheduler import shared_scheduler
 
-st.title("Visitor Clickstream Analysis")
 
-path = "data/clickstream_data.csv"
+st.title("Visitor Clickstream Analysis")
 
-headers=["Source", "Device", "Link 1", "Link 2", "Link 3" , "Link 4", "Link 5", "Link 6", "Link 7", "Link 8", "Link 9", "Link 10", "Link 11", "Link 12", "Link 13", "Link 14", "Link 15", "Link 16"]
+profiler = st.session_state.setdefault('profiler', Profiler())  # Shared with the main page
+profiler.start_run("playground")
 
 try:
-    df = pd.read_csv(path, on_bad_lines='skip', names=headers,  encoding='utf-8')
-    st.success("Database loaded successfully")
+    incremental = use_incremental()  # Hourly drops in data/incoming are merged into a persisted state
+    streaming = incremental or use_streaming()  # Exports too large for memory are folded chunk by chunk
+    version = incoming_version() if incremental else file_key(DATA_PATH)  # Known without loading anything
 except Exception as e:
     st.error(f"❌ Error loading data: {e}")
     st.stop()
 
-if st.toggle("Dataframe Summary"):
-    st.write(df.describe())
-
-
-
-def bounce_rate_by_source(df):
-  bounce_rates = {}
-  for source, group in df.groupby('Source'):
-    single_page_visits = group['Link 2'].isnull().sum()
-    bounce_rate = (single_page_visits / len(group)) * 100
-    bounce_rates[source] = bounce_rate
-  return bounce_rates
-
-def pages_before_event(df, target_event='purchase_start'):
-    pages_before = Counter()
-    for _, row in df.iterrows():
-        for i in range(1, 17):  # Check from Link 1 to Link 16
-            if row[f'Link {i}'] == target_event:
-                try:
-                    next_page = row[f'Link {i-1}']
-                    pages_before[next_page] += 1
-                except:
-                    next_page = "start"
-                    pages_before[next_page] += 1
-                break  # Move to the next row once the target event is found
-    return pages_before
-
-def pages_after_event(df, target_event='purchase_start'):
-    pages_after = Counter()
-    for _, row in df.iterrows():
-        for i in range(1, 17):  # Check from Link 1 to Link 16
-            if row[f'Link {i}'] == target_event:
-                next_page = row[f'Link {i+1}']
-                pages_after[next_page] += 1
-                break  # Move to the next row once the target event is found
-    return pages_after
-
-link_cols = [f"Link {i}" for i in range(1, 17)]
-df['path'] = df[link_cols].apply(lambda row: [link for link in row.dropna().tolist()], axis=1)
-
-def avg_links_to_purchase(df, selected_source=None):
-    if selected_source:
-        filtered_df = df[df['Source'] == selected_source]
-    else:
-        filtered_df = df
-    successful_paths = filtered_df[filtered_df['path'].apply(lambda p: 'purchase_success' in p)]
-    if not successful_paths.empty:
-        avg_links = successful_paths['path'].apply(len).mean()
-        return avg_links
-    else:
-        return 0
-
-def calculate_purchase_success_rate(df, selected_source=None):
-    if selected_source:
-        filtered_df = df[df['Source'] == selected_source]
-    else:
-        filtered_df = df
-    if not filtered_df.empty:
-        purchase_success_rate = (filtered_df['path'].apply(lambda p: 'purchase_success' in p).sum() / len(filtered_df)) * 100
-        return purchase_success_rate
-    else:
-        return 0
-
-def avg_links_visited_by_source(df, selected_sources=None):
-    if selected_sources:
-        filtered_df = df[df['Source'] == selected_sources]
- # Use isin for multiple sources
-    else:
-        filtered_df = df
-    if not filtered_df.empty:
-        filtered_df['links_visited'] = filtered_df[link_cols].notna().sum(axis=1)  # Count non-null links
-        avg_links = filtered_df['links_visited'].mean()
-        return avg_links
-    else:
-        return 0
-
-def conversion_rate_by_device(df, selected_sources=None):
-    if selected_sources:
-        filtered_df = df[df['Source'] == selected_sources]
-    else:
-        filtered_df = df
-    if not filtered_df.empty:
-        conversion_rates = filtered_df.groupby('Device')['path'].apply(lambda x: (x.apply(lambda p: 'purchase_success' in p).sum() / len(x)) * 100).to_dict()
-        return conversion_rates
-    else:
-        return {}
-
-def conversion_rate_by_page(df, selected_sources=None, pages=None):
-    if selected_sources:
-        filtered_df = df[df['Source'].isin(selected_sources)]
-    else:
-        filtered_df = df
-    if pages:
-        filtered_df['last_page'] = filtered_df['path'].apply(lambda x: x[-1] if x else None)
-        filtered_df = filtered_df[filtered_df['last_page'].isin(pages)]
-    if not filtered_df.empty:
-        conversion_rates = (filtered_df['path'].apply(lambda p: 'purchase_success' in p).sum() / len(filtered_df)) * 100
-        return conversion_rates
-    else:
-        return 0
-
-bounce_rates_by_source = bounce_rate_by_source(df)
+# Everything is computed in the background, starting with the aggregates
+# themselves; the page paints right away and each tab fills in as its own
+# results complete. Results are shared across reruns and sessions.
+scheduler = shared_scheduler()
+aggregates_task = scheduler.submit((version, "aggregates"), refresh if incremental else load_aggregates)
+kpis_task = scheduler.submit((version, "kpis"), lambda: aggregates_task.result().kpis())  # Sliced by tabs 1-4
+transitions_task = scheduler.submit((version, "transitions"), lambda: aggregates_task.result().transition_matrix())
+status = st.empty()
+status.info("Loading data...")
+
+if not streaming and st.toggle("Dataframe Summary"):
+    st.write(load_clickstream().describe())  # The frame is only loaded for the summary
+
+
 
 st.sidebar.header("Select Source")
 
 st.title("Analytics")
 
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["All", "Advertisement (Campaign)", "Social Shares", "Organic Outreach", "Pages"])
 
-with tab1:
+def render_all(kpis):
     st.header("Analytics for all")
     col1, col2, col3 = st.columns(3)
     with col1:
-        single_page_visits = df['Link 2'].isnull().sum()
-        bounce_rate = (single_page_visits / len(df)) * 100
+        bounce_rate = kpi_row(kpis)['bounce_rate']
         st.write(f"**Bounce Rate:** {bounce_rate:.2f}%")
         st.write("-----")
         selected_sources=["direct", "linkedin_advert", "partner_advert", "facebook_advert", "linkedin_share", "facebook_share", "search"]
         if selected_sources:  # For multiselect
             for source in selected_sources:
-                st.write(f"{source}: {bounce_rates_by_source[source]:.2f}%")
+                st.write(f"{source}: {kpi_row(kpis, source)['bounce_rate']:.2f}%")
     with col2:
-        df['links_visited'] = df.notnull().sum(axis=1) - 2  # Subtract 2 for 'Source' and 'Device'
-        average_links_visited = df['links_visited'].mean()
+        average_links_visited = kpi_row(kpis)['avg_links']
         st.write(f"**Average Links Visited:** {average_links_visited:.2f}")
         selected_source_filter=None
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
         st.write(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.write(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
 
@@ -153,7 +69,9 @@ with tab1:
     st.header("Takeaways")
     st.write("1 - Hii")
     st.write("2 - Second Takeaway")
-with tab2:
+
+
+def render_campaigns(kpis):
     st.header("Campaigns (Facebook/Linkedin/Partner)")
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -161,37 +79,41 @@ with tab2:
         st.write("**Bounce Rates:**")
         if selected_sources:  # For multiselect
             for source in selected_sources:
-                st.write(f"{source}: {bounce_rates_by_source[source]:.2f}%")#
+                st.write(f"{source}: {kpi_row(kpis, source)['bounce_rate']:.2f}%")#
     with col2:
-        avg_links=avg_links_visited_by_source(df, selected_source_filter)
         st.write("Linkedin Advert -")
         selected_source_filter="linkedin_advert"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
-        avg_links_visited=avg_links_visited_by_source(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
+        avg_links_visited = source_kpis['avg_links']
         st.caption(f"Average Links Visited: {avg_links_visited:.2f}")
         st.caption(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.caption(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
         st.write("Facebook Advert -")
         selected_source_filter="facebook_advert"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
-        avg_links_visited=avg_links_visited_by_source(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
+        avg_links_visited = source_kpis['avg_links']
         st.caption(f"Average Links Visited: {avg_links_visited:.2f}")
         st.caption(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.caption(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
         st.write("Partner Advert -")
         selected_source_filter="partner_advert"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
-        avg_links_visited=avg_links_visited_by_source(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
+        avg_links_visited = source_kpis['avg_links']
         st.caption(f"Average Links Visited: {avg_links_visited:.2f}")
         st.caption(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.caption(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
-with tab3:
+
+
+def render_social(kpis):
     st.header("Social Shares (Facebook/Linkedin)")
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -199,23 +121,27 @@ with tab3:
         st.write("**Bounce Rates:**")
         if selected_sources:  # For multiselect
             for source in selected_sources:
-                st.write(f"{source}: {bounce_rates_by_source[source]:.2f}%")
+                st.write(f"{source}: {kpi_row(kpis, source)['bounce_rate']:.2f}%")
     with col2:
         st.write("Linkedin Share -")
         selected_source_filter="linkedin_share"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
         st.write(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.write(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
         st.write("Facebook Share -")
         selected_source_filter="facebook_share"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
         st.write(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.write(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
-with tab4:
+
+
+def render_organic(kpis):
     st.header("Organic(Direct / Search)")
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -223,25 +149,80 @@ with tab4:
         st.write("**Bounce Rates:**")
         if selected_sources:  # For multiselect
             for source in selected_sources:
-                st.write(f"{source}: {bounce_rates_by_source[source]:.2f}%")
+                st.write(f"{source}: {kpi_row(kpis, source)['bounce_rate']:.2f}%")
     with col2:
         st.write("Direct")
         selected_source_filter="direct"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
         st.write(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.write(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
         st.write("Search - ")
         selected_source_filter="search"
         # Path to Purchase Success (Bounce Rate Removed)
-        avg_links = avg_links_to_purchase(df, selected_source_filter)
-        purchase_success_rate = calculate_purchase_success_rate(df, selected_source_filter)
+        source_kpis = kpi_row(kpis, selected_source_filter or ALL)
+        avg_links = source_kpis['avg_links_to_purchase']
+        purchase_success_rate = source_kpis['conversion_rate']
         st.write(f"Average Links Visited to Purchase: {avg_links:.2f}")
         st.write(f"Purchase Success Rate: {purchase_success_rate:.2f}%")
 
 
+def render_pages(transitions):
+    st.header("Pages Before / After an Event")
+    pages = [state for state in transitions.states if state not in (START, EXIT)]
+    targets = st.multiselect("Target pages", pages, key="targets", default=[p for p in ["purchase_start"] if p in pages])
+    before = scheduler.submit((version, "predecessors", tuple(sorted(targets))), transitions.predecessors, targets)
+    after = scheduler.submit((version, "successors", tuple(sorted(targets))), transitions.successors, targets)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("**Pages before:**")
+        st.dataframe(before.result().rename("Count"))
+    with col2:
+        st.write("**Pages after:**")
+        st.dataframe(after.result().rename("Count"))
 
-st.write("-----")
 
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["All", "Advertisement (Campaign)", "Social Shares", "Organic Outreach", "Pages"])
+renders = {
+    kpis_task: [(tab1, "All", render_all), (tab2, "Advertisement (Campaign)", render_campaigns),
+                (tab3, "Social Shares", render_social), (tab4, "Organic Outreach", render_organic)],
+    transitions_task: [(tab5, "Pages", render_pages)],
+}
+waiting = {}
+for task, tabs in renders.items():
+    for tab, name, render in tabs:
+        with tab:
+            waiting[name] = st.empty()
+            waiting[name].info("Computing...")
+
+# The tasks run in pool threads outside the rerun's profiler, so record how
+# long the page waited on each of them instead
+with step("wait: aggregates"):
+    aggregates_task.exception()
+names = {kpis_task: "kpis", transitions_task: "transitions"}
+completed = as_completed(renders)
+for _ in renders:
+    with step("wait") as record:
+        task = next(completed)
+        record['name'] = f"wait: {names[task]}"
+    if aggregates_task.exception() is None:
+        status.success("Database loaded successfully")
+    for tab, name, render in renders[task]:
+        with tab, step(f"tab: {name}"):
+            waiting[name].empty()
+            if task.exception() is not None:
+                st.error(f"❌ Error loading data: {task.exception()}")
+            else:
+                render(task.result())
+if aggregates_task.exception() is not None:
+    status.error(f"❌ Error loading data: {aggregates_task.exception()}")
+
+
+
+st.write("-----")
 
+profiler.end_run()
+if st.sidebar.toggle("Show performance panel"):
+    render_sidebar(profiler)
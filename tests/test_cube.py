@@ -0,0 +1,45 @@
+"""Cube-backed metrics on a page vocabulary larger than int16 codes."""
+import numpy as np
+import pytest
+
+from clickstream import metrics
+from clickstream.comparison import Bootstrap
+from clickstream.cube import SessionCube
+from clickstream.sessions import SessionStore
+
+N_PAGES = 40_000
+
+
+@pytest.fixture(scope='module')
+def store():
+    pages = [f'page_{i:05d}' for i in range(N_PAGES - 1)] + ['purchase_success']
+    paths = [[0, 33_001], [33_002, 5], [33_003, 33_004], [1, N_PAGES - 1], [33_005]]
+    codes = np.array([code for path in paths for code in path], dtype=np.int32)
+    offsets = np.r_[0, np.cumsum([len(path) for path in paths])].astype(np.int64)
+    sources = np.array([0, 0, 1, 1, 0], dtype=np.int16)
+    devices = np.array([0, 1, 0, 1, 0], dtype=np.int16)
+    return SessionStore(pages, codes, offsets, ['direct', 'search'], sources, ['desktop', 'mobile'], devices)
+
+
+def test_cells_keep_large_page_codes(store):
+    cube = SessionCube.from_store(store, metrics.CONVERSION_PAGE)
+    assert cube.count() == len(store)
+    assert sorted(cube.cells['first_page'].tolist()) == [0, 1, 33_002, 33_003, 33_005]
+    assert sorted(cube.cells['last_page'].tolist()) == [5, 33_001, 33_004, 33_005, N_PAGES - 1]
+
+
+def test_page_metrics_count_large_page_codes(store):
+    assert metrics.conversion_rate_by_first_page(store, pages=['page_33003', 'page_33005']) == 0
+    assert metrics.conversion_rate_by_page(store, pages=['page_33001', 'purchase_success']) == 50
+    assert metrics.dropoff_page_by_source_device(store) == {
+        ('direct', 'desktop'): 'page_33001',
+        ('direct', 'mobile'): 'page_00005',
+        ('search', 'desktop'): 'page_33004',
+        ('search', 'mobile'): None,
+    }
+
+
+def test_bootstrap_covers_every_session(store):
+    bootstrap = Bootstrap.from_store(store, resamples=10)
+    assert bootstrap.estimates.shape[0] == len(bootstrap.groups)
+    assert ('all', 'all') in bootstrap.groups
@@ -0,0 +1,113 @@
+"""The fast paths agree with the serial, in-memory and brute-force results.
+
+Everything runs on a small ``clickstream.synthetic`` export.
+"""
+import functools
+import itertools
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from clickstream import metrics
+from clickstream.database import SessionDatabase
+from clickstream.engine import compute_kpis
+from clickstream.loader import read_csv, to_typed
+from clickstream.parallel import map_shards, parallel_kpis, parallel_transitions, shard_store
+from clickstream.patterns import frequent_patterns
+from clickstream.sessions import SessionStore
+from clickstream.streaming import Aggregates
+from clickstream.synthetic import write_clickstream
+from clickstream.transitions import TransitionMatrix
+
+N_SESSIONS = 5_000
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    path = tmp_path_factory.mktemp('data') / 'synthetic.csv'
+    write_clickstream(str(path), N_SESSIONS, seed=7)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def store(export):
+    return SessionStore.from_frame(to_typed(read_csv(export)))
+
+
+@pytest.fixture(scope='module')
+def database(export, tmp_path_factory):
+    database = SessionDatabase(str(tmp_path_factory.mktemp('db') / 'clickstream.sqlite'))
+    database.ingest([export], chunksize=1_000)
+    yield database
+    database.close()
+
+
+def test_parallel_kpis_match_serial(store):
+    serial = compute_kpis(store)
+    parallel = parallel_kpis(store, workers=2, min_sessions=1_000)
+    assert parallel.equals(serial)
+
+
+def test_parallel_transitions_match_serial(store):
+    serial = TransitionMatrix.from_store(store)
+    parallel = parallel_transitions(store, workers=2, min_sessions=1_000)
+    assert np.array_equal(parallel.to_dense(), serial.to_dense())
+
+
+def test_merged_shard_aggregates_match_serial(store):
+    serial = Aggregates.from_store(store, approximate=False)
+    shards = shard_store(store, workers=2, min_sessions=1_000)
+    assert len(shards) == 2
+    merged = Aggregates()
+    for partial in map_shards(functools.partial(Aggregates.from_store, approximate=False), shards, workers=2):
+        merged.merge(partial)
+    assert merged.kpis().equals(serial.kpis())
+    assert merged.dropoffs.sort_index().equals(serial.dropoffs.sort_index())
+    assert merged.transitions.sort_index().equals(serial.transitions.sort_index())
+    assert dict(merged.paths) == dict(serial.paths)
+
+
+@pytest.mark.parametrize('name, args', [
+    ('bounce_rate_by_source', ()),
+    ('bounce_rate_by_source_device', ()),
+    ('bounce_rate_by_source_device', (['search', 'direct'], ['mobile'])),
+    ('avg_links_to_purchase', ()),
+    ('avg_links_to_purchase', ('search',)),
+    ('calculate_purchase_success_rate', ()),
+    ('calculate_purchase_success_rate', (['facebook_advert'],)),
+    ('avg_links_visited_by_source', (['linkedin_share'],)),
+    ('conversion_rate_by_device', ()),
+    ('conversion_rate_by_device', (['search'],)),
+    ('conversion_rate_by_page', (['search'], ['pricing', 'home'])),
+    ('conversion_rate_by_first_page', (None, ['home'])),
+    ('dropoff_page_by_source_device', ()),
+    ('dropoff_page_by_source_device', (['direct'], ['tablet', 'desktop'])),
+])
+def test_sql_metrics_match_store(store, database, name, args):
+    func = getattr(metrics, name)
+    expected, actual = func(store, *args), func(database, *args)
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected)
+        expected, actual = list(expected.values()), list(actual.values())
+    assert actual == pytest.approx(expected)
+
+
+def _subsequence_counts(paths, max_length):
+    """Sessions containing each subsequence of up to ``max_length`` pages, by enumeration."""
+    counts = Counter()
+    for path in paths:
+        counts.update({tuple(path[i] for i in positions)
+                       for k in range(1, max_length + 1)
+                       for positions in itertools.combinations(range(len(path)), k)})
+    return counts
+
+
+@pytest.mark.parametrize('sources', [None, ['search']])
+def test_pattern_supports_match_brute_force(store, sources):
+    subset = store.take(np.arange(1_500))
+    rows = np.flatnonzero(subset.source_mask(sources))
+    min_count = int(np.ceil(0.03 * len(rows)))
+    counts = _subsequence_counts([tuple(subset.path(i)) for i in rows], 3)
+    expected = sorted(((p, c) for p, c in counts.items() if c >= min_count), key=lambda item: (-item[1], item[0]))
+    assert frequent_patterns(subset, 0.03, 3, sources) == expected
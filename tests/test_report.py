@@ -0,0 +1,14 @@
+"""Reports of exports without any valid session."""
+import pytest
+
+from clickstream.report import KPI_COLUMNS, report_file, report_tables
+from clickstream.streaming import Aggregates
+
+
+@pytest.mark.parametrize('lines', ['', 'direct,,home\nsearch,,pricing\n'])
+def test_report_of_export_without_valid_sessions(tmp_path, lines):
+    path = tmp_path / 'clicks.csv'
+    path.write_text(lines)
+    assert report_file(str(path), str(tmp_path / 'out'), 'csv')
+    assert all(not len(table) for table in report_tables(Aggregates()).values())
+    assert list(report_tables(Aggregates())['platform'].columns) == ['Device'] + KPI_COLUMNS